@@ -0,0 +1,146 @@
+import argparse
+import json
+import sys
+from pathlib import Path
+
+from . import load, micro, synthetic
+
+
+def create_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Generate synthetic galleries and time the gallery's hot paths",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    generate = commands.add_parser("generate", help="Write a synthetic gallery")
+    generate.add_argument("directory", type=Path)
+    synthetic.add_arguments(generate)
+
+    run = commands.add_parser("run", help="Run the microbenchmarks on a gallery")
+    run.add_argument("directory", type=Path)
+    run.add_argument("--repeat", type=int, default=10)
+    run.add_argument("--warmup", type=int, default=2)
+    run.add_argument(
+        "--image-workers",
+        type=int,
+        default=0,
+        help="Render processes, 0 renders in threads (default: 0)",
+    )
+    run.add_argument("--load-limit", type=int, default=1000)
+    run.add_argument("--widths", type=int, nargs="+", default=list(micro.WIDTHS))
+    run.add_argument(
+        "--output", "-o", type=Path, help="Save the results as JSON to this file"
+    )
+
+    imports = commands.add_parser(
+        "imports",
+        help="Time importing the app in a fresh interpreter, exits non-zero over budget",
+    )
+    imports.add_argument(
+        "--budget",
+        type=float,
+        default=0.5,
+        help="Seconds each module may take to import (default: 0.5)",
+    )
+    imports.add_argument("--repeat", type=int, default=5)
+
+    load_test = commands.add_parser(
+        "load", help="Load test the app in-process, reporting latency per route"
+    )
+    load_test.add_argument("directory", type=Path)
+    load_test.add_argument(
+        "--mix",
+        type=load.parse_mix,
+        default=load.DEFAULT_MIX,
+        help="Relative weight per route (default: /=1,/image_element=8,/image_action=1)",
+    )
+    load_test.add_argument(
+        "--concurrency",
+        "-c",
+        type=int,
+        default=8,
+        help="Concurrent simulated reviewers (default: 8)",
+    )
+    load_test.add_argument(
+        "--requests",
+        "-n",
+        type=int,
+        default=500,
+        help="Requests to send in total (default: 500)",
+    )
+    load_test.add_argument("--seed", type=int, default=0)
+    load_test.add_argument(
+        "--app-args",
+        default="",
+        help="Extra mflux-gallery options, e.g. '--image-workers 4 --delete-mode trash'",
+    )
+    load_test.add_argument(
+        "--in-place",
+        action="store_true",
+        help="Run on the gallery itself rather than a temporary copy; images get deleted",
+    )
+    load_test.add_argument(
+        "--output", "-o", type=Path, help="Save the report as JSON to this file"
+    )
+
+    compare = commands.add_parser(
+        "compare", help="Compare two result files, exits non-zero on regressions"
+    )
+    compare.add_argument("baseline", type=Path)
+    compare.add_argument("candidate", type=Path)
+    compare.add_argument(
+        "--threshold",
+        type=float,
+        default=0.10,
+        help="Relative slowdown of the median counted as a regression (default: 0.10)",
+    )
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = create_parser().parse_args(argv)
+    if args.command == "generate":
+        spec = synthetic.spec_from_args(args)
+        paths = synthetic.generate(args.directory, spec)
+        print(f"Wrote {len(paths)} images to {args.directory}")
+    elif args.command == "run":
+        results = micro.run(
+            args.directory,
+            repeat=args.repeat,
+            warmup=args.warmup,
+            workers=args.image_workers,
+            load_limit=args.load_limit,
+            widths=tuple(args.widths),
+        )
+        if args.output is not None:
+            spec_file = args.directory / synthetic.SPEC_FILE
+            micro.save(
+                args.output,
+                results,
+                gallery=str(args.directory),
+                spec=json.loads(spec_file.read_text()) if spec_file.exists() else None,
+                repeat=args.repeat,
+                image_workers=args.image_workers,
+            )
+            print(f"Saved results to {args.output}")
+    elif args.command == "imports":
+        return 1 if micro.check_imports(args.budget, args.repeat) else 0
+    elif args.command == "load":
+        load.run(
+            args.directory,
+            mix=args.mix,
+            concurrency=args.concurrency,
+            requests=args.requests,
+            app_args=args.app_args,
+            seed=args.seed,
+            output=args.output,
+            in_place=args.in_place,
+        )
+    elif args.command == "compare":
+        return 1 if micro.compare(args.baseline, args.candidate, args.threshold) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
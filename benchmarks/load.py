@@ -0,0 +1,220 @@
+import asyncio
+import contextlib
+import json
+import math
+import random
+import shlex
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+import httpx
+
+# route -> relative weight
+DEFAULT_MIX = {"/": 1, "/image_element": 8, "/image_action": 1}
+
+
+class Sample(NamedTuple):
+    route: str
+    status: int
+    seconds: float
+
+
+def parse_mix(value: str) -> dict[str, float]:
+    """`/=1,/image_element=8,/image_action=1` into a weight per route."""
+    mix = {}
+    for part in value.split(","):
+        route, _, weight = part.partition("=")
+        if route not in DEFAULT_MIX:
+            raise ValueError(
+                f"unsupported route {route!r}, pick from {list(DEFAULT_MIX)}"
+            )
+        mix[route] = float(weight or 1)
+    return mix
+
+
+def percentile(ordered: list[float], q: float) -> float:
+    """Nearest-rank percentile of already sorted values."""
+    if not ordered:
+        return 0.0
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def _latencies(values: list[float]) -> dict:
+    ordered = sorted(values)
+    return {
+        "p50": percentile(ordered, 50),
+        "p90": percentile(ordered, 90),
+        "p99": percentile(ordered, 99),
+        "max": ordered[-1] if ordered else 0.0,
+    }
+
+
+def load_app(gallery_dir: Path, app_args: list[str]):
+    """The app for `gallery_dir`, configured like the command line would."""
+    from mflux_gallery import cli, main
+
+    return main.create_app(
+        cli.create_parser().parse_args([str(gallery_dir), *app_args])
+    )
+
+
+class LoadTest:
+    """Drives the ASGI app in-process with `concurrency` simulated reviewers.
+
+    Each reviewer repeatedly picks a route by weight: `/` renders the first page,
+    `/image_element` loads a random slide, and `/image_action` deletes an image no
+    other request touches again. The event loop's scheduling lag is sampled alongside,
+    so blocking work on the loop shows up even when per-route latencies look fine.
+    """
+
+    def __init__(
+        self,
+        app,
+        gallery,
+        mix: dict[str, float] = DEFAULT_MIX,
+        concurrency: int = 8,
+        requests: int = 500,
+        resize_width: int = 512,
+        seed: int = 0,
+    ):
+        self.app = app
+        self.gallery = gallery
+        self.mix = mix
+        self.concurrency = concurrency
+        self.requests = requests
+        self.resize_width = resize_width
+        self.rng = random.Random(seed)
+        self.samples: list[Sample] = []
+        self.loop_lag: list[float] = []
+        self._issued = 0
+
+    async def run(self) -> dict:
+        app = self.app
+        transport = httpx.ASGITransport(app=app)
+        async with app.router.lifespan_context(app):
+            # deletes pop from the end, slide loads sample from what is left
+            self.paths = sorted(self.gallery.find_paths())
+            self.rng.shuffle(self.paths)
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://load-test"
+            ) as client:
+                monitor = asyncio.create_task(self._monitor_loop())
+                started = time.perf_counter()
+                await asyncio.gather(
+                    *[self._reviewer(client) for _ in range(self.concurrency)]
+                )
+                elapsed = time.perf_counter() - started
+                monitor.cancel()
+        return self.report(elapsed)
+
+    async def _reviewer(self, client: httpx.AsyncClient):
+        routes = list(self.mix)
+        weights = list(self.mix.values())
+        while self._issued < self.requests:
+            self._issued += 1
+            route = self.rng.choices(routes, weights)[0]
+            request = self._request(route)
+            if request is None:
+                continue
+            method, url, kwargs = request
+            start = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            self.samples.append(
+                Sample(route, response.status_code, time.perf_counter() - start)
+            )
+
+    def _request(self, route: str) -> tuple[str, str, dict] | None:
+        headers = {"HX-Request": "true"}
+        if route == "/":
+            return "GET", "/", {"params": {"resize_width": self.resize_width}}
+        if not self.paths:
+            return None
+        if route == "/image_element":
+            params = {
+                "gallery_path": self.rng.choice(self.paths),
+                "resize_width": self.resize_width,
+            }
+            return "GET", route, {"params": params, "headers": headers}
+        data = {"gallery_path": self.paths.pop(), "action": "delete"}
+        return "POST", route, {"data": data, "headers": headers}
+
+    async def _monitor_loop(self, interval: float = 0.01):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.loop_lag.append(time.perf_counter() - start - interval)
+
+    def report(self, elapsed: float) -> dict:
+        routes = {}
+        for route in self.mix:
+            samples = [_ for _ in self.samples if _.route == route]
+            routes[route] = {
+                "requests": len(samples),
+                "errors": sum(1 for _ in samples if _.status >= 400),
+                "throughput": len(samples) / elapsed if elapsed else 0.0,
+                **_latencies([_.seconds for _ in samples]),
+            }
+        return {
+            "concurrency": self.concurrency,
+            "elapsed": elapsed,
+            "requests": len(self.samples),
+            "throughput": len(self.samples) / elapsed if elapsed else 0.0,
+            "routes": routes,
+            "loop_lag": _latencies(self.loop_lag),
+        }
+
+
+def print_report(report: dict):
+    print(
+        f"{report['requests']} requests in {report['elapsed']:.2f} s at concurrency "
+        f"{report['concurrency']}: {report['throughput']:.1f} req/s"
+    )
+    print(
+        f"{'route':<16} {'reqs':>6} {'errors':>6} {'req/s':>8}"
+        f" {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+    )
+    for route, stats in [*report["routes"].items(), ("loop lag", report["loop_lag"])]:
+        counts = (
+            f"{stats['requests']:>6} {stats['errors']:>6} {stats['throughput']:>8.1f}"
+            if "requests" in stats
+            else " " * 22
+        )
+        print(
+            f"{route:<16} {counts}"
+            f" {stats['p50'] * 1000:>9.2f} {stats['p90'] * 1000:>9.2f}"
+            f" {stats['p99'] * 1000:>9.2f} {stats['max'] * 1000:>9.2f}"
+        )
+
+
+def run(
+    gallery_dir: Path,
+    mix: dict[str, float] = DEFAULT_MIX,
+    concurrency: int = 8,
+    requests: int = 500,
+    app_args: str = "",
+    seed: int = 0,
+    output: Path | None = None,
+    in_place: bool = False,
+) -> dict:
+    """Load test a copy of `gallery_dir`, unless `in_place`, since the deletes are real."""
+    with contextlib.ExitStack() as stack:
+        if not in_place:
+            copy = Path(stack.enter_context(tempfile.TemporaryDirectory())) / "gallery"
+            gallery_dir = Path(shutil.copytree(gallery_dir, copy))
+        app = load_app(gallery_dir, shlex.split(app_args))
+        test = LoadTest(
+            app,
+            app.state.gallery,
+            mix,
+            concurrency=concurrency,
+            requests=requests,
+            seed=seed,
+        )
+        report = asyncio.run(test.run())
+    print_report(report)
+    if output is not None:
+        output.write_text(json.dumps({"app_args": app_args, **report}, indent=2))
+    return report
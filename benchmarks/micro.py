@@ -0,0 +1,284 @@
+import asyncio
+import inspect
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+from mflux_gallery.gallery import Gallery
+from mflux_gallery.imaging import ImageWorkerPool
+from mflux_gallery.thumbnails import ThumbnailCache
+
+WIDTHS = (256, 512, 768, 1024)
+SORT_ORDERS = ("newest", "oldest", "shuffled")
+
+
+def summarize(samples: list[float]) -> dict:
+    """Robust statistics in seconds; compare medians, the IQR shows how noisy they are."""
+    ordered = sorted(samples)
+    q1, median, q3 = (
+        statistics.quantiles(ordered, n=4) if len(ordered) > 1 else [ordered[0]] * 3
+    )
+    return {
+        "rounds": len(ordered),
+        "min": ordered[0],
+        "median": median,
+        "mean": statistics.fmean(ordered),
+        "stdev": statistics.stdev(ordered) if len(ordered) > 1 else 0.0,
+        "iqr": q3 - q1,
+        "max": ordered[-1],
+    }
+
+
+class Runner:
+    """Times callables (sync or async) after warmup rounds, with an untimed setup per round."""
+
+    def __init__(self, repeat: int = 10, warmup: int = 2):
+        self.repeat = repeat
+        self.warmup = warmup
+        self.results: dict[str, dict] = {}
+        self._loop = asyncio.new_event_loop()
+
+    def bench(
+        self,
+        name: str,
+        fn: Callable,
+        setup: Callable[[int], object] | None = None,
+        warmup: int | None = None,
+    ):
+        samples = []
+        warmup = self.warmup if warmup is None else warmup
+        for i in range(warmup + self.repeat):
+            arg = setup(i) if setup is not None else None
+            start = time.perf_counter()
+            result = fn(arg) if setup is not None else fn()
+            if inspect.isawaitable(result):
+                self._loop.run_until_complete(result)
+            elapsed = time.perf_counter() - start
+            if i >= warmup:
+                samples.append(elapsed)
+        self.add(name, samples)
+
+    def add(self, name: str, samples: list[float]):
+        """Record samples measured elsewhere, e.g. in a subprocess."""
+        self.results[name] = summarize(samples)
+        stats = self.results[name]
+        print(
+            f"{name:<40} median {stats['median'] * 1000:9.3f} ms"
+            f"  iqr {stats['iqr'] * 1000:8.3f} ms  ({stats['rounds']} rounds)"
+        )
+
+    def close(self):
+        self._loop.close()
+
+
+# importing these is deferred until an image or a log line needs them
+DEFERRED_MODULES = ("numpy", "pillow_heif", "rich")
+IMPORT_MODULES = ("mflux_gallery.main", "mflux_gallery.imaging")
+
+
+def import_time(module: str) -> tuple[float, list[str]]:
+    """Seconds to import `module` in a fresh interpreter, and the deferred modules it loaded."""
+    code = (
+        "import sys, time; start = time.perf_counter(); "
+        f"import {module}; print(time.perf_counter() - start); "
+        f"print(*[_ for _ in {DEFERRED_MODULES!r} if _ in sys.modules])"
+    )
+    seconds, loaded = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    ).stdout.splitlines()
+    return float(seconds), loaded.split()
+
+
+def check_imports(budget: float, repeat: int = 5) -> int:
+    """Print the median import time per module, returns how many broke the budget."""
+    failures = 0
+    for module in IMPORT_MODULES:
+        runs = [import_time(module) for _ in range(repeat)]
+        median = statistics.median(seconds for seconds, _ in runs)
+        loaded = sorted({name for _, names in runs for name in names})
+        flag = ""
+        if median > budget or loaded:
+            flag = "  OVER BUDGET" if median > budget else ""
+            flag += f"  loads {', '.join(loaded)}" if loaded else ""
+            failures += 1
+        print(f"{module:<40} {median * 1000:9.3f} ms{flag}")
+    return failures
+
+
+def _app_state(gallery_dir: Path, workers: int, load_limit: int):
+    """The state the routes of an app built for `gallery_dir` read."""
+    from mflux_gallery import cli, main
+
+    return main.create_app(
+        cli.create_parser().parse_args(
+            [
+                str(gallery_dir),
+                "--no-thumbnail-store",
+                "--no-search",
+                "--image-workers",
+                str(workers),
+                "--load-limit",
+                str(load_limit),
+            ]
+        )
+    ).state
+
+
+def run(
+    gallery_dir: Path,
+    repeat: int = 10,
+    warmup: int = 2,
+    workers: int = 0,
+    load_limit: int = 1000,
+    widths: tuple[int, ...] = WIDTHS,
+) -> dict[str, dict]:
+    gallery_dir = gallery_dir.resolve()
+    runner = Runner(repeat, warmup)
+    pool = ImageWorkerPool(workers)
+    try:
+        for module in IMPORT_MODULES:
+            runner.add(
+                f"import/{module}",
+                [import_time(module)[0] for _ in range(repeat)],
+            )
+        runner.bench(
+            "gallery.iter/cold",
+            lambda g: list(g),
+            setup=lambda _: Gallery(gallery_dir, load_limit=load_limit),
+            warmup=0,
+        )
+        warm = Gallery(gallery_dir, load_limit=load_limit)
+        runner.bench("gallery.iter/warm", lambda: list(warm))
+        runner.bench(
+            "count_all_images/cold",
+            lambda g: g.count_all_images(),
+            setup=lambda _: Gallery(gallery_dir, load_limit=load_limit),
+            warmup=0,
+        )
+        runner.bench("count_all_images/warm", warm.count_all_images)
+
+        from mflux_gallery import main
+
+        state = _app_state(gallery_dir, workers, load_limit)
+        for sort_order in SORT_ORDERS:
+            runner.bench(
+                f"get_page_images/{sort_order}",
+                lambda sort_order=sort_order: main.get_page_images(
+                    state, sort_order=sort_order, resize_width=512
+                ),
+            )
+        state.gallery.image_pool.shutdown()
+
+        gallery = Gallery(
+            gallery_dir,
+            load_limit=load_limit,
+            thumbnail_cache=ThumbnailCache(),
+            image_pool=pool,
+        )
+        by_format: dict[str, list[str]] = {}
+        for path in sorted(str(Path(_).relative_to(gallery_dir)) for _ in gallery):
+            by_format.setdefault(Path(path).suffix.lower().lstrip("."), []).append(path)
+        for width in widths:
+            # decode costs differ a lot between formats, so each gets its own series
+            for fmt, samples in sorted(by_format.items()):
+
+                def cold(i, samples=samples):
+                    # a different image every round, from an empty cache
+                    gallery.thumbnail_cache.clear()
+                    return samples[i % len(samples)]
+
+                runner.bench(
+                    f"get_image_as_base64/{fmt}/{width}/cold",
+                    lambda path, width=width: gallery.get_image_as_base64(
+                        path, resize_max_width=width
+                    ),
+                    setup=cold,
+                )
+            first = next(iter(by_format.values()), [""])[0]
+            runner.bench(
+                f"get_image_as_base64/{width}/cached",
+                lambda width=width, first=first: gallery.get_image_as_base64(
+                    first, resize_max_width=width
+                ),
+            )
+        # every width of one image, as when switching widths while reviewing
+        tiered = Gallery(
+            gallery_dir,
+            load_limit=load_limit,
+            thumbnail_cache=gallery.thumbnail_cache,
+            image_pool=pool,
+            width_tiers=widths,
+        )
+        for fmt, samples in sorted(by_format.items()):
+            for name, target in (("separate", gallery), ("pyramid", tiered)):
+
+                async def all_widths(path, target=target):
+                    for width in widths:
+                        await target.get_thumbnail(path, resize_max_width=width)
+
+                def cold(i, samples=samples):
+                    gallery.thumbnail_cache.clear()
+                    return samples[i % len(samples)]
+
+                runner.bench(f"all_widths/{fmt}/{name}", all_widths, setup=cold)
+    finally:
+        pool.shutdown()
+        runner.close()
+    return runner.results
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            # the checkout, wherever the benchmarks are run from
+            cwd=Path(__file__).resolve().parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def save(path: Path, results: dict[str, dict], **context):
+    path.write_text(
+        json.dumps(
+            {"environment": environment(), **context, "results": results}, indent=2
+        )
+    )
+
+
+def compare(baseline: Path, candidate: Path, threshold: float = 0.10) -> int:
+    """Print the change in median per benchmark, returns how many regressed beyond `threshold`."""
+    base = json.loads(baseline.read_text())["results"]
+    new = json.loads(candidate.read_text())["results"]
+    regressions = 0
+    for name in sorted(base.keys() & new.keys()):
+        before, after = base[name]["median"], new[name]["median"]
+        change = (after - before) / before if before else 0.0
+        # a change inside the baseline's own spread is noise
+        noisy = abs(after - before) <= base[name]["iqr"]
+        flag = ""
+        if change > threshold and not noisy:
+            flag = "  REGRESSION"
+            regressions += 1
+        elif change < -threshold and not noisy:
+            flag = "  faster"
+        print(
+            f"{name:<40} {before * 1000:9.3f} ms -> {after * 1000:9.3f} ms"
+            f"  {change:+7.1%}{flag}"
+        )
+    return regressions
@@ -0,0 +1,170 @@
+import argparse
+import io
+import json
+import os
+import random
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+from PIL import Image, ImageDraw
+
+# written to the root of a generated gallery, so results can name what they ran on
+SPEC_FILE = "benchmark-gallery.json"
+
+FORMATS = {"jpeg": ".jpg", "png": ".png", "heic": ".heic"}
+
+_WORDS = (
+    "a cat an astronaut a lighthouse a forest a robot a city at night a portrait "
+    "in space under water made of glass watercolor cinematic lighting film grain "
+    "golden hour isometric macro photo oil painting neon foggy morning"
+).split()
+
+
+class GallerySpec(NamedTuple):
+    count: int = 1000
+    # directory levels below the root, images are spread over every level
+    depth: int = 2
+    # subdirectories per directory
+    fanout: int = 3
+    formats: tuple[str, ...] = ("jpeg", "png")
+    resolutions: tuple[tuple[int, int], ...] = ((1024, 1024), (2048, 1536))
+    # fraction of images that get a JSON sidecar
+    sidecars: float = 0.5
+    # modification times are spread over this many days before now
+    days: float = 365.0
+    seed: int = 0
+
+    def to_json(self) -> dict:
+        return {
+            **self._asdict(),
+            "formats": list(self.formats),
+            "resolutions": [f"{w}x{h}" for w, h in self.resolutions],
+        }
+
+
+def _directories(root: Path, depth: int, fanout: int) -> list[Path]:
+    dirs = [root]
+    level = [root]
+    for d in range(depth):
+        level = [
+            parent / f"level{d + 1}-{i}" for parent in level for i in range(fanout)
+        ]
+        dirs.extend(level)
+    return dirs
+
+
+def _render(size: tuple[int, int], rng: random.Random) -> Image.Image:
+    """A cheap, compressible but not trivial picture: gradients plus a few shapes."""
+    width, height = size
+    gradient = Image.linear_gradient("L")
+    img = Image.merge(
+        "RGB",
+        (
+            gradient.resize(size),
+            gradient.rotate(90).resize(size),
+            Image.effect_noise(size, rng.uniform(8, 64)),
+        ),
+    )
+    draw = ImageDraw.Draw(img)
+    for _ in range(8):
+        x0, y0 = rng.randrange(width), rng.randrange(height)
+        x1, y1 = x0 + rng.randrange(width // 2 + 1), y0 + rng.randrange(height // 2 + 1)
+        color = tuple(rng.randrange(256) for _ in range(3))
+        draw.ellipse((x0, y0, x1, y1), fill=color)
+    return img
+
+
+def _prompt(rng: random.Random) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(rng.randint(4, 12)))
+
+
+def generate(root: Path, spec: GallerySpec) -> list[Path]:
+    """Write a gallery matching `spec` under `root`, returns the image paths.
+
+    The same spec always produces the same files and names, with the same mtimes
+    relative to now, and is saved next to them as `SPEC_FILE`. HEIC needs an
+    encoder-enabled pillow_heif.
+    """
+    if "heic" in spec.formats:
+        from pillow_heif import register_heif_opener
+
+        register_heif_opener()
+    rng = random.Random(spec.seed)
+    dirs = _directories(root, spec.depth, spec.fanout)
+    for directory in dirs:
+        directory.mkdir(parents=True, exist_ok=True)
+
+    now = time.time()
+    # encoding (HEIC especially) dominates, so each resolution/format pair is encoded
+    # once and its bytes are written for every image of that kind
+    templates = {}
+    paths = []
+    for i in range(spec.count):
+        fmt = spec.formats[i % len(spec.formats)]
+        size = spec.resolutions[rng.randrange(len(spec.resolutions))]
+        if (size, fmt) not in templates:
+            buffer = io.BytesIO()
+            _render(size, rng).save(
+                buffer, format="HEIF" if fmt == "heic" else fmt.upper()
+            )
+            templates[size, fmt] = buffer.getvalue()
+        path = dirs[rng.randrange(len(dirs))] / f"image-{i:06d}{FORMATS[fmt]}"
+        path.write_bytes(templates[size, fmt])
+        if rng.random() < spec.sidecars:
+            sidecar = {
+                "prompt": _prompt(rng),
+                "guidance": round(rng.uniform(2.5, 7.5), 1),
+                "steps": rng.choice((4, 8, 20, 30)),
+                "seed": rng.randrange(2**32),
+            }
+            path.with_suffix(".json").write_text(json.dumps(sidecar))
+        mtime = now - rng.uniform(0, spec.days * 86400)
+        os.utime(path, (mtime, mtime))
+        paths.append(path)
+    (root / SPEC_FILE).write_text(json.dumps(spec.to_json(), indent=2))
+    # leave directory mtimes settled, as on a gallery that is not being written to
+    for directory in dirs:
+        os.utime(directory, (now - 60, now - 60))
+    return paths
+
+
+def _resolution(value: str) -> tuple[int, int]:
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    defaults = GallerySpec()
+    parser.add_argument("--count", type=int, default=defaults.count)
+    parser.add_argument("--depth", type=int, default=defaults.depth)
+    parser.add_argument("--fanout", type=int, default=defaults.fanout)
+    parser.add_argument(
+        "--formats",
+        nargs="+",
+        choices=sorted(FORMATS),
+        default=list(defaults.formats),
+    )
+    parser.add_argument(
+        "--resolutions",
+        nargs="+",
+        type=_resolution,
+        default=list(defaults.resolutions),
+        help="WIDTHxHEIGHT values",
+    )
+    parser.add_argument("--sidecars", type=float, default=defaults.sidecars)
+    parser.add_argument("--days", type=float, default=defaults.days)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+
+
+def spec_from_args(args: argparse.Namespace) -> GallerySpec:
+    return GallerySpec(
+        count=args.count,
+        depth=args.depth,
+        fanout=args.fanout,
+        formats=tuple(args.formats),
+        resolutions=tuple(args.resolutions),
+        sidecars=args.sidecars,
+        days=args.days,
+        seed=args.seed,
+    )
@@ -0,0 +1,182 @@
+import os
+import threading
+import time
+from collections.abc import Callable, Iterator
+from pathlib import Path
+from typing import NamedTuple
+
+from .scanner import ScanRecord, scan, scan_directory
+
+# a directory modified this recently may still change within the same mtime tick
+_MTIME_SETTLE_NS = 2_000_000_000
+
+
+class DirState(NamedTuple):
+    mtime_ns: int
+    records: list[ScanRecord]
+    subdirs: list[str]
+
+
+class CatalogChange(NamedTuple):
+    # directories (re-)listed by a refresh, with their new state
+    listed: dict[str, DirState]
+    # directories that disappeared, along with all their records
+    removed_dirs: list[str]
+    # single images dropped by `Catalog.discard`
+    discarded: list[str]
+
+
+class Catalog:
+    """Long-lived listing of the gallery, kept as one entry list per directory.
+
+    `refresh` stats every known directory and re-lists only those whose mtime changed,
+    so an unchanged tree costs one stat per directory rather than one per file. Note that
+    editing a file in place does not touch its directory's mtime; those records keep the
+    stat info from when the directory was last listed.
+    """
+
+    def __init__(
+        self,
+        root: str | Path,
+        suffixes: frozenset[str],
+        excluded_dirs: frozenset[str] = frozenset(),
+    ):
+        self.root = str(root)
+        self.suffixes = suffixes
+        self.excluded_dirs = excluded_dirs
+        # bumped whenever the set of records changes, for layers caching derived data
+        self.version = 0
+        self._dirs: dict[str, DirState] = {}
+        # number of records across `_dirs`, adjusted on every change
+        self._count = 0
+        # paths still on disk but on their way out, left out of listings
+        self._hidden: set[str] = set()
+        self._lock = threading.Lock()
+        self._listeners: list[Callable[[CatalogChange], None]] = []
+
+    def __len__(self) -> int:
+        return self._count
+
+    def subscribe(self, listener: Callable[[CatalogChange], None]):
+        """Call `listener` with every change, while the catalog lock is held."""
+        self._listeners.append(listener)
+
+    def seed(self, dirs: dict[str, DirState]):
+        """Start from a previously persisted listing; the next refresh reconciles it."""
+        with self._lock:
+            self._dirs = dict(dirs)
+            self._count = sum(len(state.records) for state in self._dirs.values())
+            self.version += 1
+
+    def refresh(self, blocking: bool = True) -> bool:
+        """Re-list directories modified since the last refresh, returns whether anything changed.
+
+        With `blocking=False` the call returns right away when another refresh is running,
+        and callers read the listing as it currently stands.
+        """
+        if not self._lock.acquire(blocking=blocking):
+            return False
+        try:
+            changed = False
+            listed = {}
+            seen = set()
+            pending = [self.root]
+            while pending:
+                directory = pending.pop()
+                previous = state = self._dirs.get(directory)
+                try:
+                    mtime_ns = os.stat(directory).st_mtime_ns
+                    if state is None or state.mtime_ns != mtime_ns:
+                        state = listed[directory] = self._list(directory, mtime_ns)
+                except OSError:
+                    # gone or unreadable, dropped below along with its records
+                    continue
+                seen.add(directory)
+                if state is not previous:
+                    changed |= (
+                        previous is None
+                        or previous.records != state.records
+                        or previous.subdirs != state.subdirs
+                    )
+                pending.extend(reversed(state.subdirs))
+
+            removed_dirs = list(self._dirs.keys() - seen)
+            for directory in removed_dirs:
+                self._count -= len(self._dirs.pop(directory).records)
+                changed = True
+            if changed:
+                self.version += 1
+            if listed or removed_dirs:
+                self._notify(CatalogChange(listed, removed_dirs, []))
+            return changed
+        finally:
+            self._lock.release()
+
+    def records(self) -> Iterator[ScanRecord]:
+        for state in list(self._dirs.values()):
+            yield from state.records
+
+    def discard(self, path: str | Path) -> bool:
+        """Drop a record right away, ahead of the next refresh noticing it is gone."""
+        path = str(path)
+        with self._lock:
+            state = self._dirs.get(os.path.dirname(path))
+            if state is None:
+                return False
+            for i, record in enumerate(state.records):
+                if record.path == path:
+                    del state.records[i]
+                    self._count -= 1
+                    self.version += 1
+                    self._notify(CatalogChange({}, [], [path]))
+                    return True
+            return False
+
+    def verify(self) -> bool:
+        """Count the images with a full walk and compare against the catalog.
+
+        On a mismatch every directory is re-listed. Returns whether the counts agreed.
+        """
+        actual = sum(1 for _ in scan(self.root, self.suffixes, self.excluded_dirs))
+        expected = self._count
+        if actual == expected:
+            return True
+        print(f"Catalog count {expected} does not match {actual} on disk, re-listing")
+        with self._lock:
+            self._dirs = {
+                directory: state._replace(mtime_ns=-1)
+                for directory, state in self._dirs.items()
+            }
+        self.refresh()
+        return False
+
+    def hide(self, path: str | Path):
+        """Keep a discarded path out of listings until `unhide`, e.g. while its delete is queued."""
+        with self._lock:
+            self._hidden.add(str(path))
+
+    def unhide(self, path: str | Path, relist: bool = False):
+        """Stop hiding `path`; with `relist` its directory is listed again on the next refresh."""
+        path = str(path)
+        with self._lock:
+            self._hidden.discard(path)
+            directory = os.path.dirname(path)
+            state = self._dirs.get(directory)
+            if relist and state is not None:
+                self._dirs[directory] = state._replace(mtime_ns=-1)
+
+    def _notify(self, change: CatalogChange):
+        for listener in self._listeners:
+            listener(change)
+
+    def _list(self, directory: str, mtime_ns: int) -> DirState:
+        records, subdirs = scan_directory(directory, self.suffixes, self.excluded_dirs)
+        if self._hidden:
+            records = [record for record in records if record.path not in self._hidden]
+        if time.time_ns() - mtime_ns < _MTIME_SETTLE_NS:
+            # too fresh to trust, list it again next time
+            mtime_ns = -1
+        previous = self._dirs.get(directory)
+        self._count += len(records) - (len(previous.records) if previous else 0)
+        state = self._dirs[directory] = DirState(mtime_ns, records, subdirs)
+        return state
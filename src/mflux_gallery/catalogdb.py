@@ -0,0 +1,163 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+from pathlib import Path
+
+from .catalog import CatalogChange, DirState
+from .imaging import read_dimensions
+from .scanner import ScanRecord
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    subdirs TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    dir TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    has_sidecar INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS images_mtime ON images (mtime_ns);
+CREATE INDEX IF NOT EXISTS images_dir ON images (dir);
+"""
+
+
+class CatalogDatabase:
+    """SQLite (WAL) copy of the catalog, so a restart can answer from the last known listing.
+
+    Subscribe `apply` to a `Catalog` to keep the database in step with every refresh.
+    Changes are written on a background thread, in order, since reading the dimensions
+    of new images is too slow to do while the catalog lock is held.
+    """
+
+    def __init__(self, db_path: Path, sidecar_suffix: str = ".json"):
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.db_path = db_path
+        self.sidecar_suffix = sidecar_suffix
+        # loaded from the caller's thread, written from the writer thread
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+        # None asks the writer to stop
+        self._changes: queue.Queue[CatalogChange | None] = queue.Queue()
+        self._writer = threading.Thread(
+            target=self._run, name="catalog-db", daemon=True
+        )
+        self._writer.start()
+
+    def load(self) -> dict[str, DirState]:
+        with self._lock:
+            dirs = {
+                path: DirState(mtime_ns, [], json.loads(subdirs))
+                for path, mtime_ns, subdirs in self._conn.execute(
+                    "SELECT path, mtime_ns, subdirs FROM dirs"
+                )
+            }
+            for path, directory, mtime_ns, size, inode in self._conn.execute(
+                "SELECT path, dir, mtime_ns, size, inode FROM images ORDER BY dir, path"
+            ):
+                state = dirs.get(directory)
+                if state is not None:
+                    state.records.append(ScanRecord(path, mtime_ns, size, inode))
+            return dirs
+
+    def apply(self, change: CatalogChange):
+        """Queue `change` to be written; called with the catalog lock held, so it only copies."""
+        # the catalog keeps mutating its record lists, e.g. on `discard`
+        listed = {
+            directory: state._replace(records=list(state.records))
+            for directory, state in change.listed.items()
+        }
+        self._changes.put(
+            CatalogChange(listed, list(change.removed_dirs), list(change.discarded))
+        )
+
+    def flush(self):
+        """Wait until every queued change has been written."""
+        self._changes.join()
+
+    def close(self):
+        self._changes.put(None)
+        self._writer.join()
+        with self._lock:
+            self._conn.close()
+
+    def _run(self):
+        while (change := self._changes.get()) is not None:
+            self._write(change)
+            self._changes.task_done()
+        self._changes.task_done()
+
+    def _write(self, change: CatalogChange):
+        try:
+            self._write_change(change)
+        except (sqlite3.Error, OSError) as e:
+            # the stored directory mtimes stay stale, so the next start re-lists them
+            print(f"Failed to update the catalog database: {e}")
+
+    def _write_change(self, change: CatalogChange):
+        with self._lock, self._conn:
+            for directory in change.removed_dirs:
+                self._conn.execute("DELETE FROM dirs WHERE path = ?", (directory,))
+                self._conn.execute("DELETE FROM images WHERE dir = ?", (directory,))
+            for directory, state in change.listed.items():
+                self._conn.executemany(
+                    "INSERT INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    self._image_rows(directory, state),
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)",
+                    (directory, state.mtime_ns, json.dumps(state.subdirs)),
+                )
+            self._conn.executemany(
+                "DELETE FROM images WHERE path = ?",
+                [(path,) for path in change.discarded],
+            )
+
+    def _image_rows(self, directory: str, state: DirState) -> list[tuple]:
+        """Rows replacing `directory`'s images, reusing dimensions of unchanged files."""
+        known = {
+            path: (mtime_ns, size, width, height)
+            for path, mtime_ns, size, width, height in self._conn.execute(
+                "SELECT path, mtime_ns, size, width, height FROM images WHERE dir = ?",
+                (directory,),
+            )
+        }
+        self._conn.execute("DELETE FROM images WHERE dir = ?", (directory,))
+        try:
+            names = set(os.listdir(directory))
+        except OSError:
+            names = set()
+
+        rows = []
+        for record in state.records:
+            previous = known.get(record.path)
+            if previous is not None and previous[:2] == (record.mtime_ns, record.size):
+                width, height = previous[2:]
+            else:
+                width, height = read_dimensions(record.path) or (None, None)
+            stem = os.path.splitext(os.path.basename(record.path))[0]
+            rows.append(
+                (
+                    record.path,
+                    directory,
+                    record.mtime_ns,
+                    record.size,
+                    record.inode,
+                    width,
+                    height,
+                    stem + self.sidecar_suffix in names,
+                )
+            )
+        return rows
@@ -1,4 +1,5 @@
 import argparse
+import os
 from pathlib import Path
 
 
@@ -68,4 +69,165 @@ def create_parser():
         help="Specify the maximum width for image resizing (default: 512)",
     )
 
+    parser.add_argument(
+        "--image-transport",
+        required=False,
+        choices=["inline", "url"],
+        default="inline",
+        help="Specify how slides embed images: inline base64 data URIs, or /thumb URLs the browser can cache (default: inline)",
+    )
+
+    parser.add_argument(
+        "--batch-window",
+        type=int,
+        required=False,
+        default=4,
+        help="Specify how many upcoming slides load their images in one batched request, 0 disables (default: 4)",
+    )
+
+    parser.add_argument(
+        "--image-workers",
+        type=int,
+        required=False,
+        default=os.cpu_count() or 1,
+        help="Specify the number of processes that decode and resize images, 0 renders in threads (default: CPU count)",
+    )
+
+    parser.add_argument(
+        "--image-queue-size",
+        type=int,
+        required=False,
+        default=None,
+        help="Specify the maximum number of queued image jobs (default: 4 per worker)",
+    )
+
+    parser.add_argument(
+        "--resample-preset",
+        required=False,
+        choices=["fast", "quality"],
+        default="quality",
+        help="Specify the resize filter preset, fast trades sharpness for CPU (default: quality)",
+    )
+
+    parser.add_argument(
+        "--encode-preset",
+        required=False,
+        choices=["fast", "balanced", "small"],
+        default="balanced",
+        help="Specify how thumbnails are encoded: fast prefers quick JPEG encodes, small prefers AVIF when the browser accepts it, then slow WEBP (default: balanced)",
+    )
+
+    parser.add_argument(
+        "--width-tiers",
+        type=int,
+        nargs="*",
+        required=False,
+        default=[256, 512, 768, 1024],
+        help="Specify the widths rendered together from one decode, as offered by the width picker, answering the requested one first; none renders each width separately (default: 256 512 768 1024)",
+    )
+
+    parser.add_argument(
+        "--prefetch-ahead",
+        type=int,
+        required=False,
+        default=5,
+        help="Specify how many upcoming slides to render in the background, 0 disables (default: 5)",
+    )
+
+    parser.add_argument(
+        "--prefetch-behind",
+        type=int,
+        required=False,
+        default=2,
+        help="Specify how many previous slides to render in the background, 0 disables (default: 2)",
+    )
+
+    parser.add_argument(
+        "--thumbnail-cache-mb",
+        type=int,
+        required=False,
+        default=256,
+        help="Specify the memory budget in MB for cached thumbnails (default: 256)",
+    )
+
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        required=False,
+        default=None,
+        help="Specify the directory for persistent caches (default: <directory>/.mflux-gallery)",
+    )
+
+    parser.add_argument(
+        "--catalog-db",
+        required=False,
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help="Keep the image catalog in SQLite under the cache directory for fast warm starts (default: disabled)",
+    )
+
+    parser.add_argument(
+        "--undo-limit",
+        type=int,
+        required=False,
+        default=10,
+        help="Specify how many recent deletes can be undone in trash mode (default: 10)",
+    )
+
+    parser.add_argument(
+        "--undo-window",
+        type=float,
+        required=False,
+        default=300,
+        help="Specify for how many seconds a delete can be undone in trash mode (default: 300)",
+    )
+
+    parser.add_argument(
+        "--count-check-interval",
+        type=float,
+        required=False,
+        default=0,
+        help="Every this many seconds, verify the image count against a full directory walk, 0 disables (default: 0)",
+    )
+
+    parser.add_argument(
+        "--duplicates",
+        required=False,
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Hash every image in the background to find near duplicates for /duplicates (default: enabled)",
+    )
+
+    parser.add_argument(
+        "--duplicate-distance",
+        type=int,
+        required=False,
+        default=4,
+        help="Specify how many of the 64 hash bits two images may differ in and still count as duplicates (default: 4)",
+    )
+
+    parser.add_argument(
+        "--search",
+        required=False,
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Index the prompts of JSON sidecars in memory for /search (default: enabled)",
+    )
+
+    parser.add_argument(
+        "--thumbnail-store",
+        required=False,
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Persist thumbnails to a pack file in the cache directory (default: enabled)",
+    )
+
+    parser.add_argument(
+        "--compact-thumbnail-store",
+        required=False,
+        action="store_true",
+        default=False,
+        help="Drop stored thumbnails of deleted or modified images on startup.",
+    )
+
     return parser
@@ -0,0 +1,256 @@
+import asyncio
+import functools
+import struct
+import threading
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+
+from . import metrics
+from .imaging import ImageWorkerPool
+from .scanner import ScanRecord
+
+# hashes per worker job: enough to amortize sending the job to a process, few enough
+# that a render queued behind it is not held up for long
+HASH_BATCH = 8
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """Burkhard-Keller tree of 64-bit hashes, for finding all hashes within a Hamming distance.
+
+    Each child edge is labelled with its distance to the parent, so a search only
+    descends into edges within `max_distance` of the query's distance to the node.
+    """
+
+    def __init__(self):
+        # node: (hash, index, {distance: child node})
+        self._root = None
+
+    def add(self, value: int, index: int):
+        node = (value, index, {})
+        if self._root is None:
+            self._root = node
+            return
+        current = self._root
+        while True:
+            distance = hamming(value, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def search(self, value: int, max_distance: int) -> list[int]:
+        """Indices of the hashes within `max_distance` of `value`."""
+        found = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node_value, index, children = stack.pop()
+            distance = hamming(value, node_value)
+            if distance <= max_distance:
+                found.append(index)
+            stack.extend(
+                child
+                for edge, child in children.items()
+                if distance - max_distance <= edge <= distance + max_distance
+            )
+        return found
+
+
+@functools.cache
+def _numpy():
+    """NumPy if installed, imported on first use; without it pairs come from a BK-tree."""
+    try:
+        import numpy as np
+    except ImportError:
+        return None
+    return np
+
+
+def _popcount(values):
+    np = _numpy()
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    # numpy < 2
+    return np.unpackbits(values.view(np.uint8).reshape(*values.shape, 8), axis=-1).sum(
+        axis=-1
+    )
+
+
+def _similar_pairs_numpy(
+    hashes: list[int], max_distance: int
+) -> Iterator[tuple[int, int]]:
+    np = _numpy()
+    values = np.array(hashes, dtype=np.uint64)
+    # compare blocks of rows against all hashes, a few million distances at a time
+    rows = max(1, (1 << 22) // len(values))
+    for start in range(0, len(values), rows):
+        block = values[start : start + rows]
+        distances = _popcount(block[:, None] ^ values[None, :])
+        for i, j in zip(*np.nonzero(distances <= max_distance)):
+            if start + i < j:
+                yield int(start + i), int(j)
+
+
+def _similar_pairs_bktree(
+    hashes: list[int], max_distance: int
+) -> Iterator[tuple[int, int]]:
+    tree = BKTree()
+    for i, value in enumerate(hashes):
+        for j in tree.search(value, max_distance):
+            yield j, i
+        tree.add(value, i)
+
+
+def group_similar(
+    hashed: Iterable[tuple[ScanRecord, int]], max_distance: int
+) -> list[list[ScanRecord]]:
+    """Groups of two or more records whose hashes chain together within `max_distance`.
+
+    Identical hashes are grouped first, so only the distinct hashes are compared:
+    with NumPy as a vectorized XOR and popcount, otherwise through a BK-tree.
+    """
+    by_hash: dict[int, list[ScanRecord]] = {}
+    for record, value in hashed:
+        by_hash.setdefault(value, []).append(record)
+    hashes = list(by_hash)
+
+    parent = list(range(len(hashes)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    if max_distance > 0 and len(hashes) > 1:
+        pairs = _similar_pairs_numpy if _numpy() is not None else _similar_pairs_bktree
+        for i, j in pairs(hashes, max_distance):
+            parent[find(i)] = find(j)
+
+    groups: dict[int, list[ScanRecord]] = {}
+    for i, value in enumerate(hashes):
+        groups.setdefault(find(i), []).extend(by_hash[value])
+    return [group for group in groups.values() if len(group) > 1]
+
+
+class PerceptualHashIndex:
+    """64-bit difference hashes of the catalogued images, kept per file mtime and size.
+
+    Hashes are computed in the image workers, a batch at a time whenever no render is
+    pending, and appended to an index file next to the thumbnail pack so they survive
+    restarts.
+    """
+
+    FILE_NAME = "phashes.idx"
+    MAGIC = b"MFXGPHS1"
+    # mtime_ns, size, hash, path length
+    RECORD = struct.Struct("<qqQH")
+
+    def __init__(self, image_pool: ImageWorkerPool, cache_dir: Path | None = None):
+        self.image_pool = image_pool
+        self.path = cache_dir / self.FILE_NAME if cache_dir is not None else None
+        self._hashes: dict[str, tuple[int, int, int]] = {}
+        # unreadable files, not retried until they change
+        self._failed: dict[str, tuple[int, int]] = {}
+        self._lock = threading.Lock()
+        self._file = None
+        if self.path is not None:
+            self._open()
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def get(self, record: ScanRecord) -> int | None:
+        entry = self._hashes.get(record.path)
+        if entry is None or entry[:2] != (record.mtime_ns, record.size):
+            return None
+        return entry[2]
+
+    def missing(self, records: Iterable[ScanRecord]) -> list[ScanRecord]:
+        return [
+            record
+            for record in records
+            if self.get(record) is None
+            and self._failed.get(record.path) != (record.mtime_ns, record.size)
+        ]
+
+    async def update(self, records: Iterable[ScanRecord]) -> int:
+        """Hash the records not hashed yet, returns how many were added."""
+        # a pass over the whole catalog, kept off the event loop
+        missing = await asyncio.to_thread(self.missing, records)
+        added = 0
+        for start in range(0, len(missing), HASH_BATCH):
+            batch = missing[start : start + HASH_BATCH]
+            # renders are what a reviewer waits for, hashing yields to them
+            await self.image_pool.idle()
+            with metrics.timed("phash"):
+                values = await self.image_pool.hash_many([_.path for _ in batch])
+            with self._lock:
+                for record, value in zip(batch, values):
+                    if value is None:
+                        self._failed[record.path] = (record.mtime_ns, record.size)
+                        continue
+                    self._hashes[record.path] = (record.mtime_ns, record.size, value)
+                    self._append(record, value)
+                    added += 1
+        return added
+
+    def groups(
+        self, records: Iterable[ScanRecord], max_distance: int
+    ) -> list[list[ScanRecord]]:
+        """Near-duplicate groups among the hashed `records`."""
+        hashed = (
+            (record, value)
+            for record in records
+            if (value := self.get(record)) is not None
+        )
+        return group_similar(hashed, max_distance)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def stats(self) -> dict:
+        return {
+            "hashed": len(self._hashes),
+            "failed": len(self._failed),
+            "backend": "numpy" if _numpy() is not None else "bktree",
+        }
+
+    def _append(self, record: ScanRecord, value: int):
+        if self._file is None:
+            return
+        path_bytes = record.path.encode("utf-8")
+        self._file.write(
+            self.RECORD.pack(record.mtime_ns, record.size, value, len(path_bytes))
+            + path_bytes
+        )
+        self._file.flush()
+
+    def _open(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        data = self.path.read_bytes() if self.path.exists() else b""
+        if not data.startswith(self.MAGIC):
+            # new or unrecognized file: start over
+            self.path.write_bytes(self.MAGIC)
+            data = self.MAGIC
+        pos = len(self.MAGIC)
+        while pos + self.RECORD.size <= len(data):
+            mtime_ns, size, value, path_len = self.RECORD.unpack_from(data, pos)
+            end = pos + self.RECORD.size + path_len
+            if end > len(data):
+                break
+            path = data[pos + self.RECORD.size : end].decode("utf-8")
+            pos = end
+            # later records supersede earlier ones for the same path
+            self._hashes[path] = (mtime_ns, size, value)
+        self._file = open(self.path, "ab")
+        if pos < len(data):
+            # drop a truncated trailing record, so appends start on a record boundary
+            self._file.truncate(pos)
@@ -1,19 +1,56 @@
+import asyncio
 import base64
-import io
+import functools
+import heapq
+import itertools
+import os
 import subprocess
+import threading
 import time
+from collections.abc import Awaitable, Callable, Iterator
 from pathlib import Path
+from typing import Literal, NamedTuple
 
-from PIL import Image
-from pillow_heif import register_heif_opener
-
-register_heif_opener()
+from . import metrics, scanner
+from .catalog import Catalog, CatalogChange
+from .catalogdb import CatalogDatabase
+from .duplicates import PerceptualHashIndex
+from .imaging import ImageWorkerPool
+from .metadata import SidecarCache
+from .scanner import ScanRecord
+from .search import PromptIndex
+from .selection import SortOrder, select_top_k
+from .thumbnails import ThumbnailCache, ThumbnailKey, ThumbnailStore
+from .trash import DeleteQueue, Deletion
 
 
 class InvalidPathValueError(ValueError):
     pass
 
 
+class NotAnImageError(ValueError):
+    """The path is a directory, or a file without one of the gallery's photo suffixes."""
+
+
+class DeleteOutcome(NamedTuple):
+    gallery_path: str
+    # None when the path was rejected or only selected
+    target: Path | None
+    # "selected" for a dry run
+    status: Literal["deleted", "missing", "forbidden", "selected"]
+
+
+def _unlink(target: Path, delete_other_suffixes: list[str] | None) -> bool:
+    if not target.exists():
+        return False
+    target.unlink()
+    for suf in delete_other_suffixes or []:
+        target_suf = target.with_suffix(suf)
+        if target_suf.exists():
+            target_suf.unlink()
+    return True
+
+
 class Gallery:
     DEFAULT_PHOTO_SUFFIXES = [".jpg", ".jpeg", ".png", ".heic"]
 
@@ -23,73 +60,386 @@ class Gallery:
         photo_suffixes: list[str] = DEFAULT_PHOTO_SUFFIXES,
         resize_max_width: int = 512,
         load_limit=1000,
+        thumbnail_cache: ThumbnailCache | None = None,
+        thumbnail_store: ThumbnailStore | None = None,
+        image_pool: ImageWorkerPool | None = None,
+        excluded_dirs: list[Path] | None = None,
+        catalog_db: CatalogDatabase | None = None,
+        sidecar_cache: SidecarCache | None = None,
+        search: bool = False,
+        delete_queue: DeleteQueue | None = None,
+        width_tiers: tuple[int, ...] = (),
+        hash_index: PerceptualHashIndex | None = None,
+        duplicate_distance: int = 4,
     ):
         self.gallery_dir = gallery_dir
         self.photo_suffixes = photo_suffixes
+        self.excluded_dirs = frozenset(str(_) for _ in excluded_dirs or [])
+        self.catalog = Catalog(
+            gallery_dir,
+            scanner.normalize_suffixes(photo_suffixes),
+            self.excluded_dirs,
+        )
+        self.catalog_db = catalog_db
+        seeded = {}
+        if catalog_db is not None:
+            seeded = catalog_db.load()
+            self.catalog.seed(seeded)
+            self.catalog.subscribe(catalog_db.apply)
         self.resize_max_width = resize_max_width
+        # a request for one of these widths renders every missing one from the same
+        # decode, answering the requested width as soon as it is encoded
+        self.width_tiers = tuple(width_tiers)
         self.load_limit = load_limit
-        self._count_cache = None
-        self._count_cache_time = 0
-        self._cache_duration = 60  # Cache for 1 minute
+        self.thumbnail_cache = (
+            thumbnail_cache if thumbnail_cache is not None else ThumbnailCache()
+        )
+        self.thumbnail_store = thumbnail_store
+        self.image_pool = image_pool if image_pool is not None else ImageWorkerPool(0)
+        self.sidecar_cache = (
+            sidecar_cache if sidecar_cache is not None else SidecarCache()
+        )
+        self.prompt_index = None
+        if search:
+            self.prompt_index = PromptIndex(self.sidecar_cache)
+            if seeded:
+                # a seeded listing only reports what the reconcile finds changed
+                self.prompt_index.apply(CatalogChange(seeded, [], []))
+            self.catalog.subscribe(self.prompt_index.apply)
+        self.delete_queue = delete_queue
+        if delete_queue is not None:
+            delete_queue.on_done = self._delete_done
+        self.hash_index = hash_index
+        # most differing bits between two hashes still counted as duplicates
+        self.duplicate_distance = duplicate_distance
+        # completed hashing passes that hashed new images
+        self._hash_passes = 0
+        # (hashing passes, groups), regrouped once another pass completes
+        self._duplicate_groups: tuple[int, list[list[ScanRecord]]] = (-1, [])
+        # (hashing passes, catalog version, the groups less images deleted since)
+        self._live_duplicates: tuple[int, int, list[list[ScanRecord]]] = (-1, -1, [])
+        self._hash_task: asyncio.Task | None = None
+        self._renders: dict[ThumbnailKey, asyncio.Task] = {}
+
+    def scan(self) -> Iterator[ScanRecord]:
+        """Walk the whole gallery once, yielding a record with stat info for every image."""
+        return scanner.scan(
+            self.gallery_dir,
+            scanner.normalize_suffixes(self.photo_suffixes),
+            self.excluded_dirs,
+        )
+
+    def refresh_catalog(self):
+        # only the very first listing is worth waiting for, later callers read the
+        # current listing while another refresh or the reconcile is in progress
+        self.catalog.refresh(blocking=self.catalog.version == 0)
+
+    def reconcile_in_background(self) -> threading.Thread:
+        """Bring a seeded catalog up to date with the filesystem without blocking requests."""
+        thread = threading.Thread(
+            target=self.catalog.refresh, name="catalog-reconcile", daemon=True
+        )
+        thread.start()
+        return thread
+
+    async def hash_in_background(self, interval: float = 30.0) -> asyncio.Task:
+        """Keep perceptual hashes of every catalogued image, checking for new ones every `interval` seconds."""
+
+        async def index():
+            while True:
+                await asyncio.to_thread(self.refresh_catalog)
+                if await self.hash_index.update(self.catalog.records()):
+                    self._hash_passes += 1
+                await asyncio.sleep(interval)
+
+        self._hash_task = asyncio.get_running_loop().create_task(index())
+        return self._hash_task
+
+    async def stop_hashing(self):
+        if self._hash_task is not None:
+            self._hash_task.cancel()
+
+    def iter_records(self) -> Iterator[ScanRecord]:
+        """Up to `load_limit` records from the catalog, after re-listing directories that changed."""
+        self.refresh_catalog()
+        return itertools.islice(self.catalog.records(), self.load_limit)
+
+    def select(
+        self,
+        sort_order: SortOrder = "newest",
+        limit: int | None = None,
+        seed: int = 0,
+        after: tuple | None = None,
+    ) -> tuple[list[ScanRecord], int]:
+        """The first `limit` records in `sort_order` (after the `after` key), plus the total number of images."""
+        with metrics.timed("scan"):
+            self.refresh_catalog()
+        with metrics.timed("select"):
+            return select_top_k(
+                self.catalog.records(),
+                limit if limit is not None else self.load_limit,
+                sort_order,
+                seed=seed,
+                after=after,
+            )
+
+    def search(
+        self, query: str, limit: int | None = None, after: tuple | None = None
+    ) -> tuple[list[ScanRecord], int]:
+        """Like `select` over the images whose prompt matches `query`, newest first."""
+        if self.prompt_index is None:
+            return [], 0
+        self.refresh_catalog()
+        with metrics.timed("search"):
+            matches = self.prompt_index.search(query)
+        return select_top_k(
+            matches,
+            limit if limit is not None else self.load_limit,
+            "newest",
+            after=after,
+        )
+
+    def duplicates(
+        self, limit: int | None = None, after: tuple | None = None
+    ) -> tuple[list[ScanRecord], int, Callable[[ScanRecord], tuple]]:
+        """Like `select` over the images with a near duplicate, plus the ordering key.
+
+        Each group's images are consecutive, newest first. Groups are ordered by their
+        smallest path, which can only move later as images are deleted, so pruning a
+        group never makes a cursor skip another one. Images are only regrouped after
+        a background hashing pass completes; groups it finds may sort before a cursor
+        handed out earlier and then show up on the next visit.
+        """
+        if self.hash_index is None:
+            return [], 0, lambda record: ()
+        with metrics.timed("scan"):
+            self.refresh_catalog()
+        with metrics.timed("duplicates"):
+            groups = self._duplicate_group_list()
+            group_of = {}
+            for group in groups:
+                first = min(record.path for record in group)
+                group_of.update((record.path, first) for record in group)
+
+            def key(record: ScanRecord) -> tuple:
+                return (group_of[record.path], -record.mtime_ns, record.path)
+
+            candidates = [
+                (key(record), record)
+                for group in groups
+                for record in group
+                if after is None or key(record) > after
+            ]
+            selected = heapq.nsmallest(
+                limit if limit is not None else self.load_limit,
+                candidates,
+                key=lambda item: item[0],
+            )
+        return [record for _, record in selected], len(group_of), key
+
+    def _duplicate_group_list(self) -> list[list[ScanRecord]]:
+        """Groups as of the last hashing pass, without the images deleted since."""
+        passes, groups = self._duplicate_groups
+        if passes != self._hash_passes:
+            # the pairwise comparison, once per pass rather than per hashed batch
+            passes = self._hash_passes
+            groups = self.hash_index.groups(
+                self.catalog.records(), self.duplicate_distance
+            )
+            self._duplicate_groups = (passes, groups)
+        live_passes, version, live = self._live_duplicates
+        if (live_passes, version) != (passes, self.catalog.version):
+            version = self.catalog.version
+            paths = {record.path for record in self.catalog.records()}
+            live = [
+                kept
+                for group in groups
+                if len(kept := [_ for _ in group if _.path in paths]) > 1
+            ]
+            self._live_duplicates = (passes, version, live)
+        return live
 
     def __iter__(self) -> Path:
-        count = 0
-        for suf in self.photo_suffixes:
-            for _ in self.gallery_dir.rglob(f"*{suf}", case_sensitive=False):
-                if count <= self.load_limit:
-                    yield _
-                count += 1
+        for record in self.iter_records():
+            yield Path(record.path)
 
     def count_all_images(self) -> int:
-        """Count all images in the gallery without load limit. Results are cached for 1 minute."""
-        current_time = time.monotonic()
-
-        # Check if cache is still valid
-        if (
-            self._count_cache is not None
-            and current_time - self._count_cache_time < self._cache_duration
-        ):
-            return self._count_cache
-
-        # Recount images
-        total = 0
-        print("Recounting images...")
-        for suf in self.photo_suffixes:
-            total += sum(
-                1 for _ in self.gallery_dir.rglob(f"*{suf}", case_sensitive=False)
-            )
+        """Number of images in the gallery without load limit, kept exact by the catalog."""
+        if self.catalog.version == 0:
+            self.refresh_catalog()
+        return len(self.catalog)
 
-        # Update cache
-        self._count_cache = total
-        self._count_cache_time = current_time
+    def check_count_in_background(self, interval: float) -> threading.Thread:
+        """Every `interval` seconds, compare the catalog's count against a full walk."""
 
-        return total
+        def check():
+            while True:
+                time.sleep(interval)
+                self.catalog.verify()
 
-    def invalidate_count_cache(self):
-        """Invalidate the count cache, forcing a recount on next access."""
-        self._count_cache = None
-        self._count_cache_time = 0
+        thread = threading.Thread(target=check, name="catalog-check", daemon=True)
+        thread.start()
+        return thread
 
-    async def get_image_as_base64(
+    def stats(self) -> dict[str, dict]:
+        """`stats()` of every cache, queue and index, keyed by component."""
+        components = {
+            "catalog": {"images": len(self.catalog), "version": self.catalog.version},
+            "thumbnail_cache": self.thumbnail_cache.stats(),
+            "sidecar_cache": self.sidecar_cache.stats(),
+            "image_pool": self.image_pool.stats(),
+        }
+        if self.thumbnail_store is not None:
+            components["thumbnail_store"] = self.thumbnail_store.stats()
+        if self.prompt_index is not None:
+            components["prompt_index"] = self.prompt_index.stats()
+        if self.delete_queue is not None:
+            components["delete_queue"] = self.delete_queue.stats()
+        if self.hash_index is not None:
+            components["hash_index"] = {
+                **self.hash_index.stats(),
+                "duplicate_groups": len(self._live_duplicates[2]),
+            }
+        return components
+
+    def thumbnail_key(
         self, gallery_path, format="WEBP", resize_max_width: int = None
-    ) -> str:
+    ) -> ThumbnailKey:
+        """Identify a rendition by the source file's current mtime and size, raises if missing."""
         # Use provided resize_max_width or fall back to instance default
         resize_width = (
             resize_max_width if resize_max_width is not None else self.resize_max_width
         )
+        with metrics.timed("stat"):
+            return ThumbnailKey.for_file(
+                self.gallery_dir / gallery_path,
+                resize_width or 0,
+                format,
+                self.image_pool.settings,
+            )
 
-        with Image.open(self.gallery_dir / gallery_path) as img:
-            original_width, original_height = img.size
-            if resize_width and resize_width < original_width:
-                resize_height = int((resize_width / original_width) * original_height)
-                img = img.resize(
-                    (resize_width, resize_height), Image.Resampling.LANCZOS
-                )
-            buffer = io.BytesIO()
-            img.save(buffer, format=format)
-            buffer.seek(0)
-            img_bytes = buffer.read()
-        base64_str = base64.b64encode(img_bytes).decode("utf-8")
+    async def get_thumbnail(
+        self, gallery_path, format="WEBP", resize_max_width: int = None
+    ) -> bytes | memoryview:
+        """Return the encoded thumbnail bytes, served from the caches when the file is unchanged."""
+        return await self.load_thumbnail(
+            self.thumbnail_key(gallery_path, format, resize_max_width)
+        )
+
+    def has_thumbnail(self, key: ThumbnailKey) -> bool:
+        """Whether `key` is cached or already being rendered, without counting a cache lookup."""
+        return (
+            key in self.thumbnail_cache
+            or key in self._renders
+            or (self.thumbnail_store is not None and key in self.thumbnail_store)
+        )
+
+    async def load_thumbnail(self, key: ThumbnailKey) -> bytes | memoryview:
+        with metrics.timed("cache"):
+            img_bytes = self.thumbnail_cache.get(key)
+            if img_bytes is None and self.thumbnail_store is not None:
+                img_bytes = self.thumbnail_store.get(key)
+        if img_bytes is not None:
+            return img_bytes
+
+        # concurrent requests for one rendition (e.g. a prefetch and the slide itself)
+        # share a single render; shield it so one caller giving up does not cancel it
+        render = self._renders.get(key)
+        if render is None:
+            render = self._start_render(key)
+        return await asyncio.shield(render)
+
+    def _start_render(self, key: ThumbnailKey) -> asyncio.Future:
+        """Render `key`, plus the other width tiers not yet cached or being rendered."""
+        keys = [key]
+        if key.width in self.width_tiers:
+            for width in self.width_tiers:
+                tier = key._replace(width=width)
+                if width != key.width and not self.has_thumbnail(tier):
+                    keys.append(tier)
+        if len(keys) == 1:
+            pyramid = asyncio.ensure_future(self._render(keys))
+            return self._track_render(key, self._rendition(pyramid, key))
+        early = asyncio.get_running_loop().create_future()
+        pyramid = asyncio.ensure_future(self._render(keys, early))
+        render = self._track_render(key, self._early_rendition(pyramid, early, key))
+        for tier in keys[1:]:
+            self._track_render(tier, self._rendition(pyramid, tier))
+        return render
+
+    def _track_render(
+        self, key: ThumbnailKey, rendition: Awaitable[bytes]
+    ) -> asyncio.Task:
+        """Register `key`'s rendition, so concurrent requests share it."""
+        render = self._renders[key] = asyncio.ensure_future(rendition)
+        render.add_done_callback(functools.partial(self._render_done, key))
+        return render
+
+    def _render_done(self, key: ThumbnailKey, render: asyncio.Future):
+        self._renders.pop(key, None)
+        # tiers nobody asked for yet still fail quietly, awaiting callers get the error
+        if not render.cancelled():
+            render.exception()
+
+    @staticmethod
+    async def _rendition(pyramid: asyncio.Future, key: ThumbnailKey) -> bytes:
+        return (await pyramid)[key]
+
+    @staticmethod
+    async def _early_rendition(
+        pyramid: asyncio.Future, early: asyncio.Future, key: ThumbnailKey
+    ) -> bytes:
+        # the pyramid can finish first, when it failed or the early result came late
+        await asyncio.wait([pyramid, early], return_when=asyncio.FIRST_COMPLETED)
+        if early.done():
+            return early.result()
+        return pyramid.result()[key]
+
+    async def _render(
+        self, keys: list[ThumbnailKey], early: asyncio.Future | None = None
+    ) -> dict[ThumbnailKey, bytes]:
+        """Render `keys`, all of one image, and cache them.
+
+        With `early`, the first key is rendered before the others and `early` gets its
+        bytes as soon as they are encoded.
+        """
+        first = keys[0]
+        stored = set()
+
+        def store(key: ThumbnailKey, data: bytes):
+            if key in stored:
+                return
+            stored.add(key)
+            self.thumbnail_cache.put(key, data)
+            if self.thumbnail_store is not None:
+                self.thumbnail_store.put(key, data)
+
+        def first_done(result):
+            store(first, result.data)
+            if not early.done():
+                early.set_result(result.data)
+
+        results = await self.image_pool.render_pyramid(
+            first.path,
+            tuple(_.width for _ in keys),
+            first.format,
+            first=first.width if early is not None else None,
+            on_first=first_done if early is not None else None,
+        )
+        renditions = {}
+        for key, result in zip(keys, results):
+            renditions[key] = result.data
+            store(key, result.data)
+        return renditions
+
+    async def get_image_as_base64(
+        self, gallery_path, format="WEBP", resize_max_width: int = None
+    ) -> str:
+        img_bytes = await self.get_thumbnail(
+            gallery_path, format=format, resize_max_width=resize_max_width
+        )
+        with metrics.timed("base64"):
+            base64_str = base64.b64encode(img_bytes).decode("utf-8")
         return f"data:image/{format.lower()};base64,{base64_str}"
 
     async def resolve_target(self, gallery_path: str | Path) -> Path:
@@ -101,25 +451,129 @@ class Gallery:
         except ValueError as ve:
             raise InvalidPathValueError(f"cannot jailbreak to {target=}") from ve
 
+    def is_image(self, target: Path) -> bool:
+        """Whether `target` is a regular file with one of the gallery's photo suffixes."""
+        return target.suffix.lower() in self.catalog.suffixes and target.is_file()
+
+    async def resolve_image(self, gallery_path: str | Path) -> Path:
+        """Like `resolve_target`, and raises `NotAnImageError` for anything but an image.
+
+        Paths inside the excluded directories (the caches and the trash) are refused
+        like paths outside the gallery.
+        """
+        target = await self.resolve_target(gallery_path)
+        if any(target.is_relative_to(_) for _ in self.excluded_dirs):
+            raise InvalidPathValueError(f"{target=} is in an excluded directory")
+        if target.exists() and not self.is_image(target):
+            raise NotAnImageError(f"{gallery_path} is not an image")
+        return target
+
     async def delete_item(
         self, gallery_path: str | Path, delete_other_suffixes: list[str] | None = None
     ) -> tuple[Path, bool]:
-        target = await self.resolve_target(gallery_path)
-        if target.exists():
-            target.unlink()
-            if delete_other_suffixes:
-                for suf in delete_other_suffixes:
-                    target_suf = target.with_suffix(suf)
-                    if target_suf.exists():
-                        target_suf.unlink()
-            # Decrement cache if valid, otherwise invalidate
-            if self._count_cache is not None:
-                self._count_cache -= 1
+        target = await self.resolve_image(gallery_path)
+        with metrics.timed("delete"):
+            # invalidation and the catalog lock are kept off the event loop
+            [deleted] = await asyncio.to_thread(
+                self._delete_targets, [(gallery_path, target)], delete_other_suffixes
+            )
+        return target, deleted
+
+    async def delete_items(
+        self,
+        gallery_paths: list[str | Path],
+        delete_other_suffixes: list[str] | None = None,
+    ) -> list[DeleteOutcome]:
+        """Delete many images at once, each checked like `delete_item`, one outcome per path.
+
+        Paths escaping the gallery or naming anything but an image are reported as
+        forbidden rather than failing the batch.
+        """
+        targets = await asyncio.gather(
+            *[self.resolve_image(_) for _ in gallery_paths], return_exceptions=True
+        )
+        valid = []
+        for gallery_path, target in zip(gallery_paths, targets):
+            if isinstance(target, (InvalidPathValueError, NotAnImageError)):
+                continue
+            if isinstance(target, BaseException):
+                raise target
+            valid.append((gallery_path, target))
+        with metrics.timed("delete"):
+            deleted = iter(
+                await asyncio.to_thread(
+                    self._delete_targets, valid, delete_other_suffixes
+                )
+            )
+        return [
+            DeleteOutcome(str(gallery_path), None, "forbidden")
+            if isinstance(target, (InvalidPathValueError, NotAnImageError))
+            else DeleteOutcome(
+                str(gallery_path), target, "deleted" if next(deleted) else "missing"
+            )
+            for gallery_path, target in zip(gallery_paths, targets)
+        ]
+
+    def find_paths(
+        self, folder: Path | None = None, modified_before: float | None = None
+    ) -> list[str]:
+        """Gallery paths of the images under `folder` and/or last modified before a timestamp."""
+        self.refresh_catalog()
+        prefix = os.path.join(folder, "") if folder is not None else None
+        return [
+            os.path.relpath(record.path, self.gallery_dir)
+            for record in self.catalog.records()
+            if (prefix is None or record.path.startswith(prefix))
+            and (modified_before is None or record.mtime < modified_before)
+        ]
+
+    def _delete_targets(
+        self,
+        targets: list[tuple[str | Path, Path]],
+        delete_other_suffixes: list[str] | None,
+    ) -> list[bool]:
+        """Drop each target from caches and catalog, then delete it, returns which existed."""
+        results = []
+        queued = []
+        for gallery_path, target in targets:
+            for cache in (self.thumbnail_cache, self.thumbnail_store):
+                if cache is not None:
+                    cache.invalidate(self.gallery_dir / gallery_path)
+                    cache.invalidate(target)
+            known = self.catalog.discard(self.gallery_dir / gallery_path)
+            known |= self.catalog.discard(target)
+            self.sidecar_cache.invalidate(self.gallery_dir / gallery_path)
+            self.sidecar_cache.invalidate(target)
+            # only ever delete image files, never a directory or the app's own files
+            if not (known or self.is_image(target)):
+                results.append(False)
+            elif self.delete_queue is None:
+                results.append(_unlink(target, delete_other_suffixes))
             else:
-                self.invalidate_count_cache()
-            return target, True
-        else:
-            return target, False
+                # the file stays on disk until the queue gets to it, keep it out of listings
+                self.catalog.hide(target)
+                companions = [
+                    target.with_suffix(_) for _ in delete_other_suffixes or []
+                ]
+                queued.append((target, companions))
+                results.append(True)
+        if queued:
+            # submitted together, so the queue handles them as one batch
+            self.delete_queue.submit_many(queued)
+        return results
+
+    def undo_delete(self) -> Deletion | None:
+        """Bring back the most recent delete still within the queue's undo window."""
+        if self.delete_queue is None:
+            return None
+        deletion = self.delete_queue.undo()
+        if deletion is not None:
+            self.catalog.unhide(deletion.path, relist=True)
+            self.catalog.refresh()
+        return deletion
+
+    def _delete_done(self, deletion: Deletion):
+        self.catalog.unhide(deletion.path)
 
     async def show_in_finder(self, gallery_path: str | Path):
         target = await self.resolve_target(gallery_path)
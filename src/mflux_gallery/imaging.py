@@ -0,0 +1,473 @@
+import asyncio
+import functools
+import io
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+
+from PIL import Image
+
+from . import metrics
+
+# opened through pillow_heif, whose plugin is only loaded once one of these shows up
+HEIF_SUFFIXES = frozenset({".heic", ".heif", ".hif"})
+_heif_registered = False
+
+
+def open_image(path: str) -> Image.Image:
+    """`Image.open`, registering the HEIF plugin first if the file needs it."""
+    global _heif_registered
+    if not _heif_registered and os.path.splitext(path)[1].lower() in HEIF_SUFFIXES:
+        from pillow_heif import register_heif_opener
+
+        register_heif_opener()
+        _heif_registered = True
+    return Image.open(path)
+
+
+class ResamplePreset(NamedTuple):
+    resample: Image.Resampling
+    # how much larger than the output the reduced decode must stay, see `Image.resize`
+    reducing_gap: float
+
+
+RESAMPLE_PRESETS = {
+    "fast": ResamplePreset(Image.Resampling.BILINEAR, 1.5),
+    "quality": ResamplePreset(Image.Resampling.LANCZOS, 3.0),
+}
+
+
+class EncodePreset(NamedTuple):
+    # output formats in order of preference, each used if the client accepts it
+    formats: tuple[str, ...]
+    # Pillow save options per format
+    options: dict[str, dict]
+
+
+ENCODE_PRESETS = {
+    "fast": EncodePreset(
+        ("JPEG", "WEBP"),
+        {
+            "JPEG": {"quality": 80},
+            "WEBP": {"quality": 80, "method": 0},
+            "AVIF": {"quality": 60, "speed": 10},
+        },
+    ),
+    # WEBP at Pillow's defaults, as served before presets existed
+    "balanced": EncodePreset(
+        ("WEBP", "JPEG"),
+        {
+            "WEBP": {"quality": 80, "method": 4},
+            "JPEG": {"quality": 85, "optimize": True, "progressive": True},
+            "AVIF": {"quality": 60, "speed": 8},
+        },
+    ),
+    "small": EncodePreset(
+        ("AVIF", "WEBP", "JPEG"),
+        {
+            "AVIF": {"quality": 50, "speed": 6},
+            "WEBP": {"quality": 75, "method": 6},
+            "JPEG": {"quality": 75, "optimize": True, "progressive": True},
+        },
+    ),
+}
+
+
+@functools.cache
+def avif_available() -> bool:
+    """Whether this Pillow build can encode AVIF (built in since Pillow 11.2)."""
+    from PIL import features
+
+    return "avif" in features.modules and bool(features.check_module("avif"))
+
+
+def _accepted_types(accept: str) -> tuple[set[str], set[str]]:
+    """Media types an `Accept` header allows, and those it refuses with q=0."""
+    accepted, refused = set(), set()
+    for part in accept.split(","):
+        media_type, *params = [_.strip() for _ in part.split(";")]
+        q = next((_[2:] for _ in params if _.startswith("q=")), "1")
+        try:
+            (accepted if float(q) > 0 else refused).add(media_type.lower())
+        except ValueError:
+            continue
+    return accepted, refused
+
+
+def negotiate_format(accept: str | None, preset: str = "balanced") -> str:
+    """The preset's most preferred format that an `Accept` header allows.
+
+    WEBP and JPEG are assumed to be displayable wherever images are accepted at all,
+    AVIF is only chosen when the client names it, as browsers do for image requests.
+    """
+    accepted, refused = _accepted_types(accept or "*/*")
+    wildcard = bool(accepted & {"*/*", "image/*"})
+    for format in ENCODE_PRESETS[preset].formats:
+        media_type = f"image/{format.lower()}"
+        if media_type in refused or (format == "AVIF" and not avif_available()):
+            continue
+        if media_type in accepted or (wildcard and format != "AVIF"):
+            return format
+    return "JPEG"
+
+
+def _encode(img: Image.Image, format: str, options: dict) -> bytes:
+    if format == "JPEG" and img.mode not in ("RGB", "L"):
+        # JPEG has no alpha channel, flatten transparency onto white
+        rgba = img.convert("RGBA")
+        img = Image.new("RGB", rgba.size, "white")
+        img.paste(rgba, mask=rgba.getchannel("A"))
+    buffer = io.BytesIO()
+    img.save(buffer, format=format, **options)
+    return buffer.getvalue()
+
+
+class RenderResult(NamedTuple):
+    data: bytes
+    source_size: tuple[int, int]
+    decoded_size: tuple[int, int]
+    output_size: tuple[int, int]
+    # (stage, seconds) measured inside the worker: decode, resize, encode
+    timings: tuple[tuple[str, float], ...] = ()
+
+    @property
+    def decode_ratio(self) -> float:
+        """Decoded pixels per output pixel along the width, 1.0 is a perfect reduced decode."""
+        return self.decoded_size[0] / self.output_size[0]
+
+
+def _target_size(
+    source_size: tuple[int, int], resize_width: int
+) -> tuple[int, int] | None:
+    """Output size for `resize_width`, or None when the image is no wider than that."""
+    original_width, original_height = source_size
+    if not resize_width or resize_width >= original_width:
+        return None
+    return resize_width, max(1, int((resize_width / original_width) * original_height))
+
+
+def render_pyramid(
+    path: str,
+    widths: tuple[int, ...],
+    format: str = "WEBP",
+    preset: str = "quality",
+    encode_preset: str = "balanced",
+    first: int | None = None,
+    on_rendered: Callable[[RenderResult], None] | None = None,
+) -> tuple[RenderResult, ...]:
+    """Decode one image once and render it at every width, results in `widths` order.
+
+    Runs inside the worker processes. The image is decoded at the smallest scale
+    sufficient for the largest width (JPEGs with DCT scaling via `Image.draft`), then
+    each smaller width is resized from the one above it rather than from the original.
+    Widths at or above the original's share one encode. The decode time is reported
+    with the largest width only.
+
+    With `first`, that width is resized straight from the decode and encoded before
+    the others, and handed to `on_rendered` as soon as it is; the decode time is then
+    reported with it.
+    """
+    resample, reducing_gap = RESAMPLE_PRESETS[preset]
+    options = ENCODE_PRESETS[encode_preset].options.get(format, {})
+    started = time.perf_counter()
+    with open_image(path) as img:
+        source_size = img.size
+        descending = sorted(
+            set(widths), key=lambda _: _ or source_size[0], reverse=True
+        )
+        largest = _target_size(source_size, descending[0])
+        if largest is not None and img.format == "JPEG":
+            img.draft(
+                None, (int(largest[0] * reducing_gap), int(largest[1] * reducing_gap))
+            )
+        decoded_size = img.size
+        img.load()
+        timings = [("decode", time.perf_counter() - started)]
+        results = {}
+        data = None
+        decoded = img
+        if first is not None:
+            step_started = time.perf_counter()
+            target_size = _target_size(source_size, first)
+            if target_size is not None and target_size[0] < img.width:
+                decoded = img.resize(target_size, resample, reducing_gap=reducing_gap)
+            resized = time.perf_counter()
+            first_data = _encode(decoded, format, options)
+            encoded = time.perf_counter()
+            timings += [
+                ("resize", resized - step_started),
+                ("encode", encoded - resized),
+            ]
+            results[first] = RenderResult(
+                first_data, source_size, decoded_size, decoded.size, tuple(timings)
+            )
+            timings = []
+            if on_rendered is not None:
+                on_rendered(results[first])
+            if decoded is img:
+                data = first_data
+        for width in descending:
+            if width == first:
+                # the widths below continue from this one
+                img, data = decoded, results[first].data
+                continue
+            step_started = time.perf_counter()
+            target_size = _target_size(source_size, width)
+            if target_size is not None and target_size[0] < img.width:
+                img = img.resize(target_size, resample, reducing_gap=reducing_gap)
+                data = None
+            resized = time.perf_counter()
+            if data is None:
+                data = _encode(img, format, options)
+            encoded = time.perf_counter()
+            timings += [
+                ("resize", resized - step_started),
+                ("encode", encoded - resized),
+            ]
+            results[width] = RenderResult(
+                data, source_size, decoded_size, img.size, tuple(timings)
+            )
+            timings = []
+    return tuple(results[width] for width in widths)
+
+
+def render_thumbnail(
+    path: str,
+    resize_width: int,
+    format: str = "WEBP",
+    preset: str = "quality",
+    encode_preset: str = "balanced",
+) -> RenderResult:
+    """Decode at the smallest sufficient scale, resize and encode one image."""
+    return render_pyramid(path, (resize_width,), format, preset, encode_preset)[0]
+
+
+def perceptual_hash(path: str) -> int:
+    """64-bit difference hash: whether each pixel of a 9x8 grayscale copy is brighter than its right neighbour.
+
+    Robust to resizing and re-encoding, so near-identical images land within a few bits.
+    """
+    with open_image(path) as img:
+        # a reduced JPEG decode is plenty for 72 pixels
+        img.draft("L", (64, 64))
+        small = img.convert("L").resize((9, 8), Image.Resampling.BOX, reducing_gap=2.0)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left, right = pixels[row * 9 + col], pixels[row * 9 + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def _perceptual_hash_or_none(path: str) -> int | None:
+    try:
+        return perceptual_hash(path)
+    except (OSError, Image.DecompressionBombError):
+        return None
+
+
+def perceptual_hashes(paths: list[str]) -> list[int | None]:
+    """`perceptual_hash` of each path, None for unreadable files; runs in the workers."""
+    return [_perceptual_hash_or_none(path) for path in paths]
+
+
+# renders with an early width send it back to the server through this queue, one for
+# the whole server process and handed to every worker as it starts, so it outlives them
+_early_results = None
+# job id -> (loop, callback) of pyramid renders waiting for their early width
+_early_callbacks: dict[int, tuple] = {}
+_early_jobs = itertools.count()
+
+
+def _early_queue():
+    global _early_results
+    if _early_results is None:
+        _early_results = multiprocessing.get_context("spawn").SimpleQueue()
+        threading.Thread(
+            target=_receive_early, name="early-renders", daemon=True
+        ).start()
+    return _early_results
+
+
+def _init_worker(early_results):
+    global _early_results
+    _early_results = early_results
+
+
+def _send_early(job: int, result: RenderResult):
+    _early_results.put((job, result))
+
+
+def _receive_early():
+    while True:
+        _deliver_early(*_early_results.get())
+
+
+def _deliver_early(job: int, result: RenderResult):
+    entry = _early_callbacks.get(job)
+    if entry is None:
+        # the whole pyramid already came back
+        return
+    loop, callback = entry
+    try:
+        loop.call_soon_threadsafe(callback, result)
+    except RuntimeError:
+        # the loop closed meanwhile
+        pass
+
+
+def read_dimensions(path: str) -> tuple[int, int] | None:
+    """Image size from the file header, without decoding pixels."""
+    try:
+        with open_image(path) as img:
+            return img.size
+    except (OSError, Image.DecompressionBombError):
+        return None
+
+
+class ImageWorkerPool:
+    """Runs `render_pyramid` off the event loop with a bounded number of queued jobs.
+
+    `workers=0` renders in the default thread pool instead of separate processes.
+    """
+
+    def __init__(
+        self,
+        workers: int | None = None,
+        queue_size: int | None = None,
+        preset: str = "quality",
+        encode_preset: str = "balanced",
+    ):
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.queue_size = queue_size or max(self.workers, 1) * 4
+        self.preset = preset
+        self.encode_preset = encode_preset
+        self.pending = 0
+        # decodes, and the widths rendered from them
+        self.renders = 0
+        self.tiers = 0
+        self._decode_ratio_total = 0.0
+        # format -> [encodes, encode seconds, output bytes]
+        self._formats: dict[str, list] = {}
+        self._slots = asyncio.Semaphore(self.queue_size)
+        self._executor = None
+        if self.workers > 0:
+            # spawn rather than fork: the server process runs threads
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(_early_queue(),),
+            )
+
+    @property
+    def settings(self) -> str:
+        """The presets renders depend on, part of every thumbnail's cache key."""
+        return f"{self.preset}.{self.encode_preset}"
+
+    def negotiate_format(self, accept: str | None) -> str:
+        return negotiate_format(accept, self.encode_preset)
+
+    async def idle(self, poll: float = 0.05):
+        """Wait until no render is queued or running, for background work that yields to them."""
+        while self.pending:
+            await asyncio.sleep(poll)
+
+    async def render(
+        self, path: str, resize_width: int, format: str = "WEBP"
+    ) -> RenderResult:
+        return (await self.render_pyramid(path, (resize_width,), format))[0]
+
+    async def render_pyramid(
+        self,
+        path: str,
+        widths: tuple[int, ...],
+        format: str = "WEBP",
+        first: int | None = None,
+        on_first: Callable[[RenderResult], None] | None = None,
+    ) -> tuple[RenderResult, ...]:
+        """Render several widths of one image from a single decode, see `render_pyramid`.
+
+        `on_first` is called on the event loop with the `first` width's result while the
+        worker goes on with the others.
+        """
+        self.pending += 1
+        started = time.perf_counter()
+        job = None
+        on_rendered = None
+        if on_first is not None:
+            job = next(_early_jobs)
+            _early_callbacks[job] = (asyncio.get_running_loop(), on_first)
+            on_rendered = functools.partial(
+                _deliver_early if self._executor is None else _send_early, job
+            )
+        try:
+            async with self._slots:
+                loop = asyncio.get_running_loop()
+                results = await loop.run_in_executor(
+                    self._executor,
+                    render_pyramid,
+                    path,
+                    widths,
+                    format,
+                    self.preset,
+                    self.encode_preset,
+                    first,
+                    on_rendered,
+                )
+        finally:
+            self.pending -= 1
+            _early_callbacks.pop(job, None)
+        self.renders += 1
+        self.tiers += len(results)
+        self._decode_ratio_total += max(
+            results, key=lambda _: _.output_size[0]
+        ).decode_ratio
+        timings = [timing for result in results for timing in result.timings]
+        totals = self._formats.setdefault(format.upper(), [0, 0.0, 0])
+        for result in results:
+            totals[0] += 1
+            totals[1] += sum(_ for stage, _ in result.timings if stage == "encode")
+            totals[2] += len(result.data)
+        # waiting for a slot and a worker, plus moving the job between processes
+        worker_seconds = sum(seconds for _, seconds in timings)
+        metrics.record("render_queue", time.perf_counter() - started - worker_seconds)
+        for stage, seconds in timings:
+            metrics.record(stage, seconds)
+        return results
+
+    async def hash_many(self, paths: list[str]) -> list[int | None]:
+        """`perceptual_hash` of several images in one job."""
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, perceptual_hashes, paths)
+
+    def stats(self) -> dict:
+        stats = {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "pending": self.pending,
+            "preset": self.preset,
+            "encode_preset": self.encode_preset,
+            "renders": self.renders,
+            "tiers": self.tiers,
+            "mean_decode_ratio": (
+                self._decode_ratio_total / self.renders if self.renders else 0.0
+            ),
+        }
+        for format, (encodes, seconds, size) in sorted(self._formats.items()):
+            name = format.lower()
+            stats[f"{name}_encodes"] = encodes
+            stats[f"{name}_encode_seconds"] = seconds
+            stats[f"{name}_encoded_bytes"] = size
+        return stats
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
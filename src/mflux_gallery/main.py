@@ -1,35 +1,46 @@
+import argparse
+import asyncio
+import collections
 import json
-import os
 import random
 import time
 import typing as t
+from datetime import datetime
+from urllib.parse import quote
 
 from fasthtml.common import *
 from fasthtml.components import Swiper_Container, Swiper_Slide
-from rich import print  # noqa
-from starlette.responses import RedirectResponse
+from starlette.middleware import Middleware
+from starlette.responses import JSONResponse, RedirectResponse
+from starlette.routing import Route
+
+from . import (
+    catalogdb,
+    cli,
+    duplicates,
+    gallery,
+    imaging,
+    metrics,
+    prefetch,
+    selection,
+    thumbnails,
+    trash,
+)
 
-from . import cli, gallery
+# upper bound on slides rendered by one /image_elements request
+MAX_IMAGE_BATCH = 16
+# widths offered by the width picker
+RESIZE_WIDTHS = (256, 512, 768, 1024)
 
-parser = cli.create_parser()
-args = parser.parse_args()
+rt = APIRouter()
 
-GALLERY_DIR = args.directory.resolve()
 
-if not GALLERY_DIR.exists():
-    print(f"Error: Directory '{GALLERY_DIR}' does not exist.")
-    exit(1)
+def print(*objects, **kwargs):
+    """rich's `print`, imported on first use to keep it out of the import path."""
+    from rich import print as rich_print
 
-if not GALLERY_DIR.is_dir():
-    print(f"Error: '{GALLERY_DIR}' is not a directory.")
-    exit(1)
+    rich_print(*objects, **kwargs)
 
-try:
-    app_gallery = gallery.Gallery(GALLERY_DIR, resize_max_width=args.resize_max_width)
-    os.chdir(GALLERY_DIR)
-except (FileNotFoundError, PermissionError) as e:
-    print(f"Error accessing directory '{GALLERY_DIR}': {e}")
-    exit(1)
 
 swiper_js = Script(
     src="https://cdn.jsdelivr.net/npm/swiper@11/swiper-element-bundle.min.js"
@@ -173,6 +184,67 @@ custom_handlers = Script(
         }, 100);
     });
 
+    // Drop the slides of every image removed by one /bulk_delete request
+    document.addEventListener('bulk-delete-successful', function(event) {
+        const swiper = $("swiper-container")[0].swiper;
+        const deleted = new Set(event.detail.deleted);
+        const indexes = [];
+        swiper.slides.forEach((slide, index) => {
+            const input = slide.querySelector('input[name="gallery_path"]');
+            if (input && deleted.has(input.value)) {
+                indexes.push(index);
+            }
+        });
+        if (indexes.length) {
+            swiper.removeSlide(indexes);
+        }
+    });
+
+    // Slides appended by the next-page sentinel
+    document.addEventListener('htmx:afterSwap', function(event) {
+        if (event.detail.target.tagName === 'SWIPER-CONTAINER') {
+            event.detail.target.swiper.update();
+            loadUpcomingImages();
+        }
+    });
+
+    // Load the images of the next few slides in a single request
+    function loadUpcomingImages() {
+        const container = $("swiper-container")[0];
+        const windowSize = parseInt(container?.dataset.batchWindow || '0');
+        if (!container?.swiper || !windowSize) {
+            return;
+        }
+        const swiper = container.swiper;
+        const params = new URLSearchParams();
+        const start = swiper.activeIndex + 1;
+        swiper.slides.slice(start, start + windowSize).forEach(slide => {
+            const lazyImage = slide.querySelector('[id^="lazy-image-"][hx-get]:not([data-batched])');
+            if (!lazyImage) {
+                return;
+            }
+            const vals = JSON.parse(lazyImage.getAttribute('hx-vals'));
+            lazyImage.setAttribute('data-batched', '');
+            params.append('gallery_path', vals.gallery_path);
+            params.append('slide', vals.slide);
+            params.set('view', vals.view);
+            if (vals.resize_width) {
+                params.set('resize_width', vals.resize_width);
+            }
+        });
+        if (params.has('gallery_path')) {
+            htmx.ajax('GET', '/image_elements?' + params.toString(), {swap: 'none'});
+        }
+    }
+
+    document.addEventListener('DOMContentLoaded', () => {
+        const container = $("swiper-container")[0];
+        if (container) {
+            container.addEventListener('swiperslidechange', loadUpcomingImages);
+            setTimeout(loadUpcomingImages, 0);
+        }
+    });
+
     // Button loading state handling
     function setButtonLoading(button, isLoading) {
         if (isLoading) {
@@ -228,6 +300,13 @@ custom_handlers = Script(
         }
     });
 
+    // Typing into the search box must not trigger the hotkeys below
+    document.addEventListener('keydown', function(event) {
+        if (event.target.matches('input, textarea, select')) {
+            event.stopImmediatePropagation();
+        }
+    }, true);
+
     document.addEventListener('keydown', function(event) {
         if (event.key === 'f') {
             $(".swiper-slide-active button.show-in-finder")[0]?.click();
@@ -272,6 +351,17 @@ custom_handlers = Script(
         }
     });
 
+    document.addEventListener('keydown', function(event) {
+        if (event.key === 'u') {
+            htmx.ajax('POST', '/undo_delete', {swap: 'none'});
+        }
+    });
+
+    // A restored image is back in the listing, reload to show it
+    document.addEventListener('undo-successful', function(event) {
+        window.location.reload();
+    });
+
     document.addEventListener('keydown', function(event) {
         if (event.key === 'a') {
             event.preventDefault();
@@ -696,35 +786,66 @@ def get_created_recency_description(path_st_mtime):
         return f"{diff_secs / 86_400:,.0f} days ago"
 
 
-def get_image_metadata(img_path):
-    """Load JSON metadata for an image if it exists."""
-    json_path = img_path.with_suffix(".json")
-    if json_path.exists():
-        try:
-            with open(json_path, "r") as f:
-                data = json.load(f)
-                return data
-        except (json.JSONDecodeError, IOError):
-            return None
-    return None
-
+async def get_page_images(
+    state,
+    sort_order="newest",
+    resize_width=None,
+    cursor=None,
+    seed=0,
+    page_size=None,
+    query=None,
+):
+    """Render one page of slides, returns the tags and the cursor for the next page.
 
-def get_page_images(sort_order="newest", resize_width=None):
-    reverse = sort_order == "newest"
-    matches = sorted(
-        list(iter(app_gallery)), key=lambda _: _.stat().st_mtime, reverse=reverse
+    With a search `query`, the page holds matching images newest first. Selecting
+    and rendering the page runs in a thread; the prefetcher learns its slide order
+    here on the event loop, where its tasks live.
+    """
+    tags, next_cursor, slides = await asyncio.to_thread(
+        _page_images, state, sort_order, resize_width, cursor, seed, page_size, query
     )
+    if slides is not None:
+        state.prefetcher.remember(*slides)
+    return tags, next_cursor
+
+
+def _page_images(state, sort_order, resize_width, cursor, seed, page_size, query):
+    """`get_page_images`, plus the view, first position and gallery paths of its slides."""
+    page_size = page_size or state.config.load_limit
+    if query is not None:
+        sort_order = "newest"
+    after, start = selection.decode_cursor(cursor, sort_order) if cursor else (None, 1)
+    key = None
+    if query is not None:
+        matches, total = state.gallery.search(query, page_size, after=after)
+        view = f"search:{query}"
+    elif sort_order == "duplicates":
+        matches, total, key = state.gallery.duplicates(page_size, after=after)
+        view = "duplicates"
+    else:
+        matches, total = state.gallery.select(
+            sort_order, page_size, seed=seed, after=after
+        )
+        view = f"{sort_order}:{seed}"
     if not matches:
-        print(f"No images found in {GALLERY_DIR}")
-        return []
+        if cursor is None and query is None and sort_order != "duplicates":
+            print(f"No images found in {state.gallery.gallery_dir}")
+        return [], None, None
+    next_cursor = None
+    if len(matches) == page_size:
+        key = key or selection.sort_key(sort_order, seed)
+        next_cursor = selection.encode_cursor(key(matches[-1]), start + len(matches))
+    gallery_paths = [
+        str(Path(_.path).relative_to(state.gallery.gallery_dir)) for _ in matches
+    ]
+    # parse the page's sidecars ahead of its slides being requested
+    state.gallery.sidecar_cache.preload(_.path for _ in matches)
+    html_started = time.perf_counter()
     tags = []
-    for count, img_path in enumerate(matches, 1):
-        if count > args.load_limit:
-            break
-        gallery_path = str(img_path.relative_to(GALLERY_DIR))
-
-        # Prepare hx_vals with gallery_path and optional resize_width
-        hx_vals = {"gallery_path": gallery_path}
+    for count, (record, gallery_path) in enumerate(zip(matches, gallery_paths), start):
+        # Prepare hx_vals with gallery_path and optional resize_width, plus the
+        # slide's place in its view so the server can prefetch its neighbours
+        hx_vals = {"gallery_path": gallery_path, "view": view, "slide": count}
         if resize_width is not None:
             hx_vals["resize_width"] = resize_width
 
@@ -732,11 +853,9 @@ def get_page_images(sort_order="newest", resize_width=None):
             Details(
                 Summary(
                     Mark(
-                        Small(
-                            f"{count} / of batch size {args.load_limit} / total: {len(matches)}"
-                        )
+                        Small(f"{count} / of batch size {page_size} / total: {total}")
                     ),
-                    Small(get_created_recency_description(img_path.stat().st_mtime)),
+                    Small(get_created_recency_description(record.mtime)),
                 ),
                 Div(
                     id=f"lazy-image-{count}",
@@ -798,41 +917,96 @@ def get_page_images(sort_order="newest", resize_width=None):
                 open=True,
             )
         )
-    return tags
-
-
-app, rt = fast_app(
-    hdrs=(
-        Meta(name="format-detection", content="telephone=no"),
-        jquery_js,
-        swiper_js,
-        custom_handlers,
-        custom_css,
-    ),
-    static_path=args.directory,
-    live=args.debug,
-    debug=args.debug,
-)
-reg_re_param("imgext", "ico|gif|GIF|heic|HEIC|jpg|JPG|jpeg|JPEG|png|PNG|webp|WEBP")
-app.static_route_exts(prefix="/", static_path=args.directory, exts="imgext")
-setup_toasts(app)
+    metrics.record("page_html", time.perf_counter() - html_started)
+    return tags, next_cursor, (view, start, gallery_paths)
 
-reg_re_param("path_segments", r"[^\.]+")
 
+def max_thumbnail_width(state) -> int:
+    """The widest thumbnail served: the picker's, the tiers' or the default width."""
+    return max(
+        *RESIZE_WIDTHS, *state.gallery.width_tiers, state.config.resize_max_width
+    )
 
-@rt("/image_element")
-async def get(session, gallery_path: str, resize_width: int = None):
-    try:
-        # Use provided resize_width or fall back to the default
-        if resize_width is None:
-            resize_width = args.resize_max_width
-        data_uri_src = await app_gallery.get_image_as_base64(
-            gallery_path, resize_max_width=resize_width
+
+def invalid_width(state, width: int) -> Response | None:
+    """A 400 response for widths that are not positive or wider than `max_thumbnail_width`."""
+    if not 1 <= width <= max_thumbnail_width(state):
+        return Response(
+            f"width must be between 1 and {max_thumbnail_width(state)}",
+            status_code=400,
         )
+    return None
+
+
+async def thumbnail_response(req):
+    state = req.app.state
+    gallery_path = req.path_params["gallery_path"]
+    try:
+        w = int(req.query_params.get("w", state.config.resize_max_width))
+    except ValueError:
+        return Response("w must be an integer", status_code=400)
+    if (error := invalid_width(state, w)) is not None:
+        return error
+    format = state.gallery.image_pool.negotiate_format(req.headers.get("accept"))
+    try:
+        await state.gallery.resolve_image(gallery_path)
+        key = state.gallery.thumbnail_key(gallery_path, format, resize_max_width=w)
+    except gallery.InvalidPathValueError:
+        return Response(f"cannot jailbreak to {gallery_path}", status_code=403)
+    except gallery.NotAnImageError as e:
+        return Response(str(e), status_code=404)
+    except FileNotFoundError:
+        return Response(f"{gallery_path} does not exist", status_code=404)
+
+    headers = {
+        "ETag": key.etag,
+        "Cache-Control": "public, max-age=31536000, immutable",
+        # the format depends on what the browser accepts
+        "Vary": "Accept",
+    }
+    if_none_match = req.headers.get("if-none-match", "")
+    if if_none_match == "*" or key.etag in [
+        tag.strip() for tag in if_none_match.split(",")
+    ]:
+        return Response(status_code=304, headers=headers)
+    try:
+        img_bytes = await state.gallery.load_thumbnail(key)
+    except FileNotFoundError:
+        return Response(f"{gallery_path} does not exist", status_code=404)
+    except OSError:
+        # e.g. a truncated file or a format Pillow cannot read
+        return Response(f"{gallery_path} cannot be decoded", status_code=415)
+    return Response(
+        img_bytes, media_type=f"image/{key.format.lower()}", headers=headers
+    )
+
+
+def _or_na(value):
+    return "n/a" if value is None else value
+
+
+async def render_image_element(
+    state, gallery_path: str, resize_width: int, format: str = "WEBP"
+):
+    try:
+        await state.gallery.resolve_image(gallery_path)
+        if state.config.image_transport == "url":
+            # raises FileNotFoundError like the inline path does
+            key = state.gallery.thumbnail_key(
+                gallery_path, resize_max_width=resize_width
+            )
+            # /thumb responses are immutable, so the URL changes with the image
+            img_src = f"/thumb/{quote(gallery_path)}?w={resize_width}&v={key.version}"
+        else:
+            img_src = await state.gallery.get_image_as_base64(
+                gallery_path, format, resize_max_width=resize_width
+            )
 
         # Load metadata if available
-        img_path = GALLERY_DIR / gallery_path
-        metadata = get_image_metadata(img_path)
+        with metrics.timed("metadata"):
+            metadata = state.gallery.sidecar_cache.get(
+                state.gallery.gallery_dir / gallery_path
+            )
 
         # Build the image display components
         components = [
@@ -841,7 +1015,7 @@ async def get(session, gallery_path: str, resize_width: int = None):
                 style="width: 100%; display: flex; justify-content: center;",
             )(
                 Img(
-                    src=f"{data_uri_src}",
+                    src=img_src,
                     style="height: auto; width: auto; max-width: 100%;",
                     cls="swiper-zoom-target",
                 )
@@ -853,7 +1027,7 @@ async def get(session, gallery_path: str, resize_width: int = None):
             metadata_components = [
                 Div(
                     Strong("Prompt: "),
-                    Code(metadata.get("prompt", "n/a"), style="white-space: pre-wrap;"),
+                    Code(_or_na(metadata.prompt), style="white-space: pre-wrap;"),
                     style="margin-top: 10px;",
                 ),
             ]
@@ -863,10 +1037,10 @@ async def get(session, gallery_path: str, resize_width: int = None):
                     Summary(
                         "📋 Metadata (",
                         Strong("Guidance: "),
-                        metadata.get("guidance", "n/a"),
+                        _or_na(metadata.guidance),
                         " / ",
                         Strong("Steps: "),
-                        metadata.get("steps", "n/a"),
+                        _or_na(metadata.steps),
                         ")",
                         style="cursor: pointer; font-weight: bold;",
                     ),
@@ -880,10 +1054,76 @@ async def get(session, gallery_path: str, resize_width: int = None):
             )
 
         return Div(*components)
+    except gallery.InvalidPathValueError:
+        return P(f"cannot jailbreak to {gallery_path}")
+    except gallery.NotAnImageError as e:
+        return P(str(e))
     except FileNotFoundError:
         return P(
             f"{gallery_path} is invalid path, does not exist, or has been previously deleted"
         )
+    except OSError:
+        # one unreadable image must not fail a whole /image_elements batch
+        return P(f"{gallery_path} cannot be decoded")
+
+
+@rt("/image_element")
+async def get(
+    req,
+    session,
+    state,
+    gallery_path: str,
+    resize_width: int = None,
+    view: str = None,
+    slide: int = None,
+):
+    # Use provided resize_width or fall back to the default
+    if resize_width is None:
+        resize_width = state.config.resize_max_width
+    if (error := invalid_width(state, resize_width)) is not None:
+        return error
+    format = state.gallery.image_pool.negotiate_format(req.headers.get("accept"))
+    image_element = await render_image_element(
+        state, gallery_path, resize_width, format
+    )
+    if view is not None and slide is not None:
+        state.prefetcher.on_view(view, slide, resize_width, format)
+    return image_element
+
+
+@rt("/image_elements")
+async def get(
+    req,
+    session,
+    state,
+    gallery_path: list[str],
+    slide: list[int],
+    resize_width: int = None,
+    view: str = None,
+):
+    """Render several slides' images concurrently, each swapped out-of-band into its slide."""
+    if len(gallery_path) != len(slide):
+        return Response("gallery_path and slide must pair up", status_code=400)
+    if len(gallery_path) > MAX_IMAGE_BATCH:
+        return Response(
+            f"at most {MAX_IMAGE_BATCH} images per request", status_code=400
+        )
+    if resize_width is None:
+        resize_width = state.config.resize_max_width
+    if (error := invalid_width(state, resize_width)) is not None:
+        return error
+    format = state.gallery.image_pool.negotiate_format(req.headers.get("accept"))
+    image_elements = await asyncio.gather(
+        *[render_image_element(state, _, resize_width, format) for _ in gallery_path]
+    )
+    if view is not None:
+        # prefetch past the batch; a batch far from the last one counts as a jump
+        state.prefetcher.on_view(view, max(slide), resize_width, format)
+    # replace the whole lazy placeholder, so its intersect trigger cannot fire again
+    return tuple(
+        Div(image_element, id=f"lazy-image-{n}", hx_swap_oob="true")
+        for n, image_element in zip(slide, image_elements)
+    )
 
 
 def log_notif(session, notif, send_toast=False, **toast_kwargs):
@@ -893,14 +1133,14 @@ def log_notif(session, notif, send_toast=False, **toast_kwargs):
 
 
 @rt("/image_action")
-async def post(session, action: str, gallery_path: str):
+async def post(session, state, action: str, gallery_path: str):
     action = action.strip().lower()
     if action not in ["delete", "show-in-finder"]:
         return Response(f"{action=} not supported", status_code=403)
 
     try:
         if action == "delete":
-            target, success = await app_gallery.delete_item(
+            target, success = await state.gallery.delete_item(
                 gallery_path, delete_other_suffixes=[".json"]
             )
             if success:
@@ -911,7 +1151,7 @@ async def post(session, action: str, gallery_path: str):
                 log_notif(session, notif, typ="warning")
 
             # Count remaining images (actual total, not load-limited)
-            remaining_images = app_gallery.count_all_images()
+            remaining_images = state.gallery.count_all_images()
 
             # Return empty response with trigger for slide removal, plus updated counter via OOB
             return (
@@ -919,7 +1159,9 @@ async def post(session, action: str, gallery_path: str):
                 HtmxResponseHeaders(trigger="delete-successful"),
             )
         elif action == "show-in-finder":
-            target, success, error_msg = await app_gallery.show_in_finder(gallery_path)
+            target, success, error_msg = await state.gallery.show_in_finder(
+                gallery_path
+            )
             if success:
                 notif = f"Opened {target.as_posix()!r} in Finder."
                 log_notif(session, notif, send_toast=True, typ="success")
@@ -930,22 +1172,157 @@ async def post(session, action: str, gallery_path: str):
                 return Response(notif, status_code=500)
     except gallery.InvalidPathValueError:
         return Response(f"cannot jailbreak to {gallery_path}", status_code=403)
+    except gallery.NotAnImageError as e:
+        return Response(str(e), status_code=403)
+
+
+@rt("/bulk_delete")
+async def post(
+    req,
+    session,
+    state,
+    gallery_path: list[str] = None,
+    folder: str = None,
+    older_than: str = None,
+    dry_run: bool = False,
+):
+    """Delete many images in one request: the listed paths plus those matching a selection.
+
+    `folder` (relative to the gallery) and `older_than` (ISO date or datetime) select
+    images from the catalog; with `dry_run` the matches are returned without deleting.
+    """
+    gallery_paths = list(gallery_path or [])
+    if folder is not None or older_than is not None:
+        try:
+            folder_path = (
+                await state.gallery.resolve_target(folder)
+                if folder is not None
+                else None
+            )
+            modified_before = (
+                datetime.fromisoformat(older_than).timestamp()
+                if older_than is not None
+                else None
+            )
+        except gallery.InvalidPathValueError:
+            return Response(f"cannot jailbreak to {folder}", status_code=403)
+        except ValueError:
+            return Response(f"{older_than=} is not an ISO date", status_code=400)
+        # a catalog refresh and a pass over every record, kept off the event loop
+        gallery_paths += await asyncio.to_thread(
+            state.gallery.find_paths, folder_path, modified_before
+        )
+    # the same image may be both listed and selected
+    gallery_paths = list(dict.fromkeys(gallery_paths))
+
+    if dry_run:
+        outcomes = [gallery.DeleteOutcome(_, None, "selected") for _ in gallery_paths]
+    else:
+        outcomes = await state.gallery.delete_items(
+            gallery_paths, delete_other_suffixes=[".json"]
+        )
+        counts = collections.Counter(_.status for _ in outcomes)
+        log_notif(
+            session,
+            f"Bulk delete: {counts['deleted']} deleted, {counts['missing']} missing, "
+            f"{counts['forbidden']} forbidden",
+        )
+    remaining_images = state.gallery.count_all_images()
+    results = [{"gallery_path": _.gallery_path, "status": _.status} for _ in outcomes]
+
+    if "HX-Request" in req.headers:
+        # counter and slide removals for the page in one response
+        deleted = [_["gallery_path"] for _ in results if _["status"] == "deleted"]
+        return (
+            Sup(remaining_images, id="photo-counter", hx_swap_oob="true"),
+            HtmxResponseHeaders(
+                trigger=json.dumps({"bulk-delete-successful": {"deleted": deleted}})
+            ),
+        )
+    return JSONResponse({"remaining": remaining_images, "results": results})
+
+
+@rt("/undo_delete")
+async def post(session, state):
+    deletion = await asyncio.to_thread(state.gallery.undo_delete)
+    if deletion is None:
+        notif = "Nothing to undo"
+        log_notif(session, notif, send_toast=True, typ="warning")
+        return Response(notif)
+    notif = f"Restored {deletion.path!r}"
+    log_notif(session, notif, send_toast=True, typ="success")
+    return (
+        Sup(state.gallery.count_all_images(), id="photo-counter", hx_swap_oob="true"),
+        HtmxResponseHeaders(trigger="undo-successful"),
+    )
+
+
+def _swiper_slides(img_elems, start=1, next_page_vals=None):
+    """Wrap slide tags numbered from `start`; a sentinel near the end fetches the next page."""
+    slides = []
+    # leave a few slides of runway so the next page arrives before the user runs out
+    sentinel_at = max(0, len(img_elems) - 3)
+    for offset, elem in enumerate(img_elems):
+        contents = [elem]
+        if next_page_vals is not None and offset == sentinel_at:
+            contents.append(
+                Div(
+                    cls="next-page-sentinel",
+                    hx_get="/slides",
+                    hx_vals=next_page_vals,
+                    hx_trigger="intersect once",
+                    hx_target="closest swiper-container",
+                    hx_swap="beforeend",
+                )
+            )
+        slides.append(Swiper_Slide(*contents, lazy=True, id=f"slide-{start + offset}"))
+    return slides
+
+
+def _next_page_vals(sort_order, next_cursor, resize_width, seed, page_size, query=None):
+    if next_cursor is None:
+        return None
+    vals = {
+        "order": sort_order,
+        "cursor": next_cursor,
+        "n": page_size,
+        "resize_width": resize_width,
+        "seed": seed,
+    }
+    if query is not None:
+        vals["q"] = query
+    return vals
 
 
 def _gallery_page(
+    state,
     title,
     img_elems,
-    mode: t.Literal["default", "shuffled", "oldest"] = "default",
+    mode: t.Literal[
+        "default", "shuffled", "oldest", "search", "duplicates"
+    ] = "default",
     resize_width: int = None,
+    next_cursor: str = None,
+    seed: int = 0,
+    query: str = None,
 ):
     # Get actual total count of images in gallery
-    total_images = app_gallery.count_all_images()
+    total_images = state.gallery.count_all_images()
     # Determine current resize width for dropdown
-    current_resize = resize_width if resize_width is not None else args.resize_max_width
-
-    return Title(GALLERY_DIR), Div(
+    current_resize = (
+        resize_width if resize_width is not None else state.config.resize_max_width
+    )
+    sort_order = mode if mode in (*selection.SORT_ORDERS, "duplicates") else "newest"
+    # keep the shuffle order or the search when only the width changes
+    mode_query = ""
+    if mode == "shuffled":
+        mode_query = f"seed={seed}&"
+    elif mode == "search":
+        mode_query = f"q={quote(query or '')}&"
+
+    return Title(state.gallery.gallery_dir), Div(
         Div()(
-            Code(GALLERY_DIR, style="font-size: 0.5em;"),
+            Code(state.gallery.gallery_dir, style="font-size: 0.5em;"),
             Sup(total_images, id="photo-counter"),
         ),
         Nav()(
@@ -953,6 +1330,23 @@ def _gallery_page(
                 Li(A(href=f"/?resize_width={current_resize}")("Latest ▶️")),
                 Li(A(href=f"/oldest?resize_width={current_resize}")("Oldest ◀️")),
                 Li(A(href=f"/shuffled?resize_width={current_resize}")("Shuffled 🔀")),
+                Li(
+                    A(href=f"/duplicates?resize_width={current_resize}")(
+                        "Duplicates 👯"
+                    )
+                ),
+                Li()(
+                    Form(action="/search", method="get", style="margin: 0;")(
+                        Input(
+                            type="search",
+                            name="q",
+                            value=query or "",
+                            placeholder="Search prompts",
+                            style="margin: 0;",
+                        ),
+                        Input(type="hidden", name="resize_width", value=current_resize),
+                    )
+                ),
                 Li()(
                     Label(
                         "Max Width: ", For="resize-select", style="margin-right: 5px;"
@@ -960,14 +1354,16 @@ def _gallery_page(
                     Select(
                         id="resize-select",
                         name="resize_width",
-                        onchange=f"window.location.href = '{'/' if mode == 'default' else '/' + mode}?resize_width=' + this.value",
+                        onchange=f"window.location.href = '{'/' if mode == 'default' else '/' + mode}?{mode_query}resize_width=' + this.value",
                     )(
-                        Option("256px", value="256", selected=(current_resize == 256)),
-                        Option("512px", value="512", selected=(current_resize == 512)),
-                        Option("768px", value="768", selected=(current_resize == 768)),
-                        Option(
-                            "1024px", value="1024", selected=(current_resize == 1024)
-                        ),
+                        *[
+                            Option(
+                                f"{width}px",
+                                value=str(width),
+                                selected=(current_resize == width),
+                            )
+                            for width in RESIZE_WIDTHS
+                        ]
                     ),
                 ),
                 Li()(
@@ -981,11 +1377,19 @@ def _gallery_page(
             )
         ),
         Swiper_Container(
-            *[
-                Swiper_Slide(elem, lazy=True, id=f"slide-{i}")
-                for i, elem in enumerate(img_elems, 1)
-            ],
+            *_swiper_slides(
+                img_elems,
+                next_page_vals=_next_page_vals(
+                    sort_order,
+                    next_cursor,
+                    current_resize,
+                    seed,
+                    state.config.load_limit,
+                    query=query,
+                ),
+            ),
             # https://swiperjs.com/swiper-api#parameters
+            data_batch_window=state.config.batch_window,
             keyboard_enabled=True,
             lazy_preload_prev_next=True,
             # centered_slides=True,
@@ -1021,6 +1425,7 @@ def _gallery_page(
                         Li(Kbd("a"), Span("Go to first slide")),
                         Li(Kbd("e"), Span("Go to last slide")),
                         Li(Kbd("d"), Span("Delete image and advance slide")),
+                        Li(Kbd("u"), Span("Undo the last delete (trash mode)")),
                         Li(Kbd("f"), Span("Show in Finder")),
                         Li(Kbd("m"), Span("Toggle metadata visibility")),
                     ),
@@ -1031,41 +1436,290 @@ def _gallery_page(
 
 
 @rt("/")
-def get(session, resize_width: int = None):
+async def get(session, state, resize_width: int = None):
     # Redirect to include resize_width parameter if not present
     if resize_width is None:
-        return RedirectResponse(f"/?resize_width={args.resize_max_width}")
-    img_elems = get_page_images(resize_width=resize_width)
+        return RedirectResponse(f"/?resize_width={state.config.resize_max_width}")
+    img_elems, next_cursor = await get_page_images(state, resize_width=resize_width)
     return _gallery_page(
-        "gallery", img_elems, mode="default", resize_width=resize_width
+        state,
+        "gallery",
+        img_elems,
+        mode="default",
+        resize_width=resize_width,
+        next_cursor=next_cursor,
     )
 
 
 @rt("/oldest")
-def get(session, resize_width: int = None):
+async def get(session, state, resize_width: int = None):
     # Redirect to include resize_width parameter if not present
     if resize_width is None:
-        return RedirectResponse(f"/oldest?resize_width={args.resize_max_width}")
-    img_elems = get_page_images(sort_order="oldest", resize_width=resize_width)
-    return _gallery_page("gallery", img_elems, mode="oldest", resize_width=resize_width)
+        return RedirectResponse(f"/oldest?resize_width={state.config.resize_max_width}")
+    img_elems, next_cursor = await get_page_images(
+        state, sort_order="oldest", resize_width=resize_width
+    )
+    return _gallery_page(
+        state,
+        "gallery",
+        img_elems,
+        mode="oldest",
+        resize_width=resize_width,
+        next_cursor=next_cursor,
+    )
 
 
 @rt("/shuffled")
-def get(session, resize_width: int = None):
-    # Redirect to include resize_width parameter if not present
+async def get(session, state, resize_width: int = None, seed: int = None):
+    # Redirect to include resize_width and a fixed seed, so reloads and pages keep one order
+    if resize_width is None or seed is None:
+        return RedirectResponse(
+            f"/shuffled?seed={seed if seed is not None else random.randrange(2**32)}"
+            f"&resize_width={resize_width or state.config.resize_max_width}"
+        )
+    img_elems, next_cursor = await get_page_images(
+        state, sort_order="shuffled", resize_width=resize_width, seed=seed
+    )
+    return _gallery_page(
+        state,
+        "gallery",
+        img_elems,
+        mode="shuffled",
+        resize_width=resize_width,
+        next_cursor=next_cursor,
+        seed=seed,
+    )
+
+
+@rt("/search")
+async def get(session, state, q: str = "", resize_width: int = None):
     if resize_width is None:
-        return RedirectResponse(f"/shuffled?resize_width={args.resize_max_width}")
-    img_elems = get_page_images(resize_width=resize_width)
-    random.shuffle(img_elems)
+        return RedirectResponse(
+            f"/search?q={quote(q)}&resize_width={state.config.resize_max_width}"
+        )
+    img_elems, next_cursor = await get_page_images(
+        state, resize_width=resize_width, query=q
+    )
+    return _gallery_page(
+        state,
+        "gallery",
+        img_elems,
+        mode="search",
+        resize_width=resize_width,
+        next_cursor=next_cursor,
+        query=q,
+    )
+
+
+@rt("/duplicates")
+async def get(session, state, resize_width: int = None):
+    """Groups of near-identical images as consecutive slides, to prune with `d`."""
+    if resize_width is None:
+        return RedirectResponse(
+            f"/duplicates?resize_width={state.config.resize_max_width}"
+        )
+    img_elems, next_cursor = await get_page_images(
+        state, sort_order="duplicates", resize_width=resize_width
+    )
     return _gallery_page(
-        "gallery", img_elems, mode="shuffled", resize_width=resize_width
+        state,
+        "gallery",
+        img_elems,
+        mode="duplicates",
+        resize_width=resize_width,
+        next_cursor=next_cursor,
+    )
+
+
+@rt("/metrics")
+def get(state):
+    """Stage latency histograms and cache, queue and index stats in Prometheus text format."""
+    components = {**state.gallery.stats(), "prefetch": state.prefetcher.stats()}
+    return Response(
+        metrics.prometheus_text(components),
+        media_type="text/plain; version=0.0.4",
+    )
+
+
+@rt("/slides")
+async def get(
+    state,
+    order: str = "newest",
+    cursor: str = None,
+    n: int = None,
+    resize_width: int = None,
+    seed: int = 0,
+    q: str = None,
+):
+    """The next batch of slides after `cursor`, appended by the sentinel in the previous batch."""
+    if order not in (*selection.SORT_ORDERS, "duplicates"):
+        return Response(f"{order=} not supported", status_code=400)
+    if resize_width is None:
+        resize_width = state.config.resize_max_width
+    page_size = max(1, min(n or state.config.load_limit, state.config.load_limit))
+    try:
+        cursor_order = "newest" if q is not None else order
+        after, start = (
+            selection.decode_cursor(cursor, cursor_order) if cursor else (None, 1)
+        )
+        img_elems, next_cursor = await get_page_images(
+            state,
+            sort_order=order,
+            resize_width=resize_width,
+            cursor=cursor,
+            seed=seed,
+            page_size=page_size,
+            query=q,
+        )
+    except selection.InvalidCursorError as e:
+        return Response(str(e), status_code=400)
+    return tuple(
+        _swiper_slides(
+            img_elems,
+            start=start,
+            next_page_vals=_next_page_vals(
+                order, next_cursor, resize_width, seed, page_size, query=q
+            ),
+        )
+    )
+
+
+def create_app(config: argparse.Namespace | None = None):
+    """Build the gallery app from parsed command line options, or from `sys.argv`.
+
+    Nothing happens on import, so the module is cheap to load from worker
+    processes, benchmarks and tests. The routes read their options, gallery and
+    prefetcher from `app.state`, so apps built here do not share state. Raises
+    `NotADirectoryError` when the gallery directory is missing or not a directory.
+    """
+    if config is None:
+        config = cli.create_parser().parse_args()
+    gallery_dir = config.directory.resolve()
+    if not gallery_dir.is_dir():
+        raise NotADirectoryError(
+            f"'{gallery_dir}' does not exist or is not a directory"
+        )
+    cache_dir = (config.cache_dir or gallery_dir / ".mflux-gallery").resolve()
+    trash_dir = trash.trash_dir(gallery_dir)
+
+    thumbnail_store = None
+    if config.thumbnail_store:
+        thumbnail_store = thumbnails.ThumbnailStore(cache_dir)
+        if config.compact_thumbnail_store:
+            kept, dropped = thumbnail_store.compact()
+            print(f"Compacted thumbnail store: kept {kept}, dropped {dropped}")
+    catalog_db = None
+    if config.catalog_db:
+        catalog_db = catalogdb.CatalogDatabase(cache_dir / "catalog.sqlite3")
+    image_pool = imaging.ImageWorkerPool(
+        workers=config.image_workers,
+        queue_size=config.image_queue_size,
+        preset=config.resample_preset,
+        encode_preset=config.encode_preset,
+    )
+    hash_index = None
+    if config.duplicates:
+        # stored next to the thumbnails, hashed by the same workers
+        hash_index = duplicates.PerceptualHashIndex(image_pool, cache_dir)
+    new_gallery = gallery.Gallery(
+        gallery_dir,
+        resize_max_width=config.resize_max_width,
+        load_limit=config.load_limit,
+        thumbnail_cache=thumbnails.ThumbnailCache(
+            max_bytes=config.thumbnail_cache_mb * 1024 * 1024
+        ),
+        thumbnail_store=thumbnail_store,
+        excluded_dirs=[cache_dir, trash_dir],
+        catalog_db=catalog_db,
+        search=config.search,
+        delete_queue=trash.DeleteQueue(
+            trash_dir,
+            mode=config.delete_mode,
+            undo_limit=config.undo_limit,
+            undo_window=config.undo_window,
+        ),
+        image_pool=image_pool,
+        width_tiers=tuple(config.width_tiers),
+        hash_index=hash_index,
+        duplicate_distance=config.duplicate_distance,
+    )
+
+    startup_tasks = []
+    if catalog_db is not None:
+        startup_tasks.append(new_gallery.reconcile_in_background)
+    if config.count_check_interval:
+        startup_tasks.append(
+            lambda: new_gallery.check_count_in_background(config.count_check_interval)
+        )
+    if hash_index is not None:
+        startup_tasks.append(new_gallery.hash_in_background)
+
+    prefetcher = prefetch.Prefetcher(
+        new_gallery, ahead=config.prefetch_ahead, behind=config.prefetch_behind
     )
 
+    app, _ = fast_app(
+        hdrs=(
+            Meta(name="format-detection", content="telephone=no"),
+            jquery_js,
+            swiper_js,
+            custom_handlers,
+            custom_css,
+        ),
+        static_path=gallery_dir,
+        live=config.debug,
+        debug=config.debug,
+        on_startup=startup_tasks or None,
+        on_shutdown=[
+            # hashing stops before the workers it runs on go away
+            new_gallery.stop_hashing,
+            new_gallery.image_pool.shutdown,
+            new_gallery.sidecar_cache.shutdown,
+            # carry out queued deletes before exiting
+            lambda: new_gallery.delete_queue.flush(timeout=10),
+            *([hash_index.close] if hash_index is not None else []),
+            *([catalog_db.close] if catalog_db is not None else []),
+        ],
+        # passed up front so it is matched before the static image routes claim /thumb/*.jpg
+        routes=[Route("/thumb/{gallery_path:path}", thumbnail_response)],
+        middleware=[Middleware(metrics.ServerTimingMiddleware)],
+    )
+    reg_re_param("imgext", "ico|gif|GIF|heic|HEIC|jpg|JPG|jpeg|JPEG|png|PNG|webp|WEBP")
+    app.static_route_exts(prefix="/", static_path=gallery_dir, exts="imgext")
+    setup_toasts(app)
+    reg_re_param("path_segments", r"[^\.]+")
+    rt.to_app(app)
+    # per-app state, read by the routes through their `state` argument
+    app.state.config = config
+    app.state.gallery = new_gallery
+    app.state.prefetcher = prefetcher
+    return app
+
 
 def main():
-    print(f"Port: {args.port}")
-    print(f"Delete Mode: {args.delete_mode}")
-    serve(host=args.host, port=args.port, reload=args.debug)
+    import uvicorn
+
+    config = cli.create_parser().parse_args()
+    print(f"Port: {config.port}")
+    print(f"Delete Mode: {config.delete_mode}")
+    host = "localhost" if config.host == "0.0.0.0" else config.host
+    print(f"Link: http://{host}:{config.port}")
+    if config.debug:
+        # the reloader builds the app in a fresh process, from the same sys.argv
+        uvicorn.run(
+            f"{__name__}:create_app",
+            factory=True,
+            host=config.host,
+            port=config.port,
+            reload=True,
+        )
+        return
+    try:
+        app = create_app(config)
+    except (FileNotFoundError, NotADirectoryError, PermissionError) as e:
+        print(f"Error: {e}")
+        exit(1)
+    uvicorn.run(app, host=config.host, port=config.port)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,147 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Iterable
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import NamedTuple
+
+
+class ImageMetadata:
+    """The sidecar fields shown next to a slide; the rest of the JSON is dropped after parsing."""
+
+    __slots__ = ("prompt", "guidance", "steps")
+
+    def __init__(self, prompt=None, guidance=None, steps=None):
+        self.prompt = prompt
+        self.guidance = guidance
+        self.steps = steps
+
+    @classmethod
+    def from_sidecar(cls, data) -> "ImageMetadata | None":
+        if not isinstance(data, dict) or not data:
+            return None
+        return cls(data.get("prompt"), data.get("guidance"), data.get("steps"))
+
+
+class _SidecarEntry(NamedTuple):
+    # None while the sidecar does not exist
+    mtime_ns: int | None
+    checked_at: float
+    metadata: ImageMetadata | None
+
+
+def sidecar_path(image_path: str | Path, suffix: str = ".json") -> str:
+    return os.path.splitext(str(image_path))[0] + suffix
+
+
+def _sidecar_mtime_ns(path: str) -> int | None:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def load_sidecar(path: str) -> ImageMetadata | None:
+    try:
+        with open(path, "rb") as f:
+            return ImageMetadata.from_sidecar(json.load(f))
+    except (OSError, ValueError):
+        return None
+
+
+class SidecarCache:
+    """Parsed sidecar metadata per image, validated against the sidecar's mtime.
+
+    An entry checked within the last `revalidate_after` seconds is returned without
+    touching the disk; older entries cost one `stat`, and the JSON is only parsed
+    again when the mtime moved. Missing sidecars are cached too.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 10_000,
+        revalidate_after: float = 5.0,
+        workers: int = 4,
+        suffix: str = ".json",
+    ):
+        self.max_entries = max_entries
+        self.revalidate_after = revalidate_after
+        self.workers = workers
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, _SidecarEntry] = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._listeners: list[Callable[[str, ImageMetadata | None], None]] = []
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, image_path: str | Path) -> ImageMetadata | None:
+        key = str(image_path)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry.checked_at < self.revalidate_after:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.metadata
+
+        path = sidecar_path(key, self.suffix)
+        mtime_ns = _sidecar_mtime_ns(path)
+        if entry is not None and entry.mtime_ns == mtime_ns:
+            self.hits += 1
+            metadata = entry.metadata
+        else:
+            self.misses += 1
+            metadata = load_sidecar(path) if mtime_ns is not None else None
+            if entry is not None:
+                for listener in self._listeners:
+                    listener(key, metadata)
+
+        with self._lock:
+            self._entries[key] = _SidecarEntry(mtime_ns, now, metadata)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return metadata
+
+    def subscribe(self, listener: Callable[[str, ImageMetadata | None], None]):
+        """Call `listener` with the image path and new metadata whenever a known sidecar changed."""
+        self._listeners.append(listener)
+
+    def preload(self, image_paths: Iterable[str | Path]) -> list[Future]:
+        """Load the sidecars of a page of images in background threads, returns right away."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="sidecars"
+            )
+        now = time.monotonic()
+        with self._lock:
+            stale = [
+                str(path)
+                for path in image_paths
+                if (entry := self._entries.get(str(path))) is None
+                or now - entry.checked_at >= self.revalidate_after
+            ]
+        return [self._executor.submit(self.get, path) for path in stale]
+
+    def invalidate(self, image_path: str | Path):
+        with self._lock:
+            self._entries.pop(str(image_path), None)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,171 @@
+import bisect
+import contextlib
+import contextvars
+import threading
+import time
+from collections.abc import Iterator
+
+# seconds, from a cache hit up to a slow HEIC decode
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+)
+
+# stage durations of the current request, in seconds, for its Server-Timing header
+_request_timings: contextvars.ContextVar[list[tuple[str, float]] | None] = (
+    contextvars.ContextVar("request_timings", default=None)
+)
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        """(le, cumulative count) pairs, ending with +Inf, as Prometheus expects."""
+        with self._lock:
+            counts = list(self.counts)
+        total = 0
+        pairs = []
+        for bound, count in zip([*map(str, self.buckets), "+Inf"], counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+
+class StageTimer:
+    """Latency histograms per named stage, which also feed the current request's Server-Timing."""
+
+    def __init__(self):
+        self.histograms: dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(stage, Histogram())
+        histogram.observe(seconds)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((stage, seconds))
+
+    @contextlib.contextmanager
+    def timed(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+
+STAGES = StageTimer()
+record = STAGES.record
+timed = STAGES.timed
+
+
+def server_timing(timings: list[tuple[str, float]]) -> str:
+    """`Server-Timing` header value, stages seen more than once are summed."""
+    totals: dict[str, float] = {}
+    for stage, seconds in timings:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    return ", ".join(
+        f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in totals.items()
+    )
+
+
+class ServerTimingMiddleware:
+    """ASGI middleware collecting the stages timed during a request into `Server-Timing`."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        timings = []
+        token = _request_timings.set(timings)
+        start = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                timings.append(("total", time.perf_counter() - start))
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", server_timing(timings).encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(token)
+
+
+# stats keys that only ever grow, exported as counters
+_COUNTER_KEYS = frozenset(
+    {
+        "hits",
+        "misses",
+        "evictions",
+        "renders",
+        "tiers",
+        "warmed",
+        "cancelled",
+        "batches",
+        "deleted",
+    }
+)
+
+# ... as do per-format totals, e.g. webp_encodes and webp_encoded_bytes
+_COUNTER_SUFFIXES = ("_encodes", "_encode_seconds", "_encoded_bytes")
+
+
+def _metric_name(name: str) -> str:
+    return "mflux_gallery_" + name.replace(".", "_").replace("-", "_")
+
+
+def prometheus_text(components: dict[str, dict], timer: StageTimer = STAGES) -> str:
+    """Render the stage histograms and the numeric `stats()` of each component."""
+    lines = []
+    name = _metric_name("stage_seconds")
+    lines.append(f"# HELP {name} Time spent per request stage.")
+    lines.append(f"# TYPE {name} histogram")
+    for stage, histogram in sorted(timer.histograms.items()):
+        for bound, count in histogram.cumulative():
+            lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {count}')
+        lines.append(f'{name}_sum{{stage="{stage}"}} {histogram.sum}')
+        lines.append(f'{name}_count{{stage="{stage}"}} {histogram.count}')
+
+    for component, stats in components.items():
+        for key, value in stats.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            if key in _COUNTER_KEYS or key.endswith(_COUNTER_SUFFIXES):
+                metric = _metric_name(f"{component}_{key}_total")
+                lines.append(f"# TYPE {metric} counter")
+            else:
+                metric = _metric_name(f"{component}_{key}")
+                lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,98 @@
+import asyncio
+from collections import OrderedDict
+
+from .gallery import Gallery, InvalidPathValueError
+
+
+class Prefetcher:
+    """Warms thumbnails of the slides around the one being viewed.
+
+    Pages register the order their slides were rendered in under a view id (sort order
+    and seed). When a slide's image is requested, the next `ahead` and previous `behind`
+    slides of that view are rendered in the background, at most `concurrency` at a time
+    so foreground requests keep priority in the image pool. A request that lands more
+    than one slide away from the previous one (a jump) cancels prefetches still queued.
+    Only call it from the event loop its prefetch tasks run on.
+    """
+
+    MAX_VIEWS = 16
+
+    def __init__(
+        self, gallery: Gallery, ahead: int = 5, behind: int = 2, concurrency: int = 1
+    ):
+        self.gallery = gallery
+        self.ahead = ahead
+        self.behind = behind
+        self.warmed = 0
+        self.cancelled = 0
+        self._views: OrderedDict[str, dict[int, str]] = OrderedDict()
+        self._positions: dict[str, int] = {}
+        self._tasks: dict[str, set[asyncio.Task]] = {}
+        self._slots = asyncio.Semaphore(concurrency)
+
+    @property
+    def enabled(self) -> bool:
+        return self.ahead > 0 or self.behind > 0
+
+    def remember(self, view: str, start: int, gallery_paths: list[str]):
+        """Record that slides `start`, `start + 1`, ... of `view` show `gallery_paths`."""
+        order = self._views.setdefault(view, {})
+        self._views.move_to_end(view)
+        order.update(enumerate(gallery_paths, start))
+        while len(self._views) > self.MAX_VIEWS:
+            stale, _ = self._views.popitem(last=False)
+            self._positions.pop(stale, None)
+            self.cancel(stale)
+
+    def on_view(
+        self, view: str, position: int, resize_width: int, format: str = "WEBP"
+    ):
+        """Called for every slide request, schedules the neighbours of `position`."""
+        if not self.enabled or view not in self._views:
+            return
+        last = self._positions.get(view)
+        self._positions[view] = position
+        if last is not None and abs(position - last) > 1:
+            self.cancel(view)
+
+        order = self._views[view]
+        neighbours = [position + i for i in range(1, self.ahead + 1)]
+        neighbours += [position - i for i in range(1, self.behind + 1)]
+        tasks = self._tasks.setdefault(view, set())
+        for neighbour in neighbours:
+            gallery_path = order.get(neighbour)
+            if gallery_path is None:
+                continue
+            task = asyncio.get_running_loop().create_task(
+                self._prefetch(gallery_path, resize_width, format)
+            )
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+    def cancel(self, view: str):
+        for task in self._tasks.pop(view, set()):
+            if task.cancel():
+                self.cancelled += 1
+
+    def stats(self) -> dict:
+        return {
+            "views": len(self._views),
+            "queued": sum(len(tasks) for tasks in self._tasks.values()),
+            "warmed": self.warmed,
+            "cancelled": self.cancelled,
+        }
+
+    async def _prefetch(self, gallery_path: str, resize_width: int, format: str):
+        async with self._slots:
+            try:
+                await self.gallery.resolve_target(gallery_path)
+                key = self.gallery.thumbnail_key(
+                    gallery_path, format, resize_max_width=resize_width
+                )
+                if self.gallery.has_thumbnail(key):
+                    return
+                await self.gallery.load_thumbnail(key)
+                self.warmed += 1
+            except (OSError, InvalidPathValueError):
+                # deleted or unreadable since the page was rendered
+                return
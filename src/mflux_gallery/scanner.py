@@ -0,0 +1,68 @@
+import os
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from typing import NamedTuple
+
+
+class ScanRecord(NamedTuple):
+    path: str
+    mtime_ns: int
+    size: int
+    inode: int
+
+    @property
+    def mtime(self) -> float:
+        return self.mtime_ns / 1e9
+
+
+def normalize_suffixes(suffixes: Iterable[str]) -> frozenset[str]:
+    return frozenset(suf.lower() for suf in suffixes)
+
+
+def scan_directory(
+    directory: str,
+    suffixes: frozenset[str],
+    excluded_dirs: frozenset[str] = frozenset(),
+) -> tuple[list[ScanRecord], list[str]]:
+    """List one directory: records for matching files, and the subdirectories to descend into.
+
+    `suffixes` must be lowercase, see `normalize_suffixes`.
+    """
+    records = []
+    subdirs = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.path not in excluded_dirs:
+                    subdirs.append(entry.path)
+            elif os.path.splitext(entry.name)[1].lower() in suffixes:
+                record = _stat_record(entry)
+                if record is not None:
+                    records.append(record)
+    return records, subdirs
+
+
+def _stat_record(entry: os.DirEntry) -> ScanRecord | None:
+    try:
+        st = entry.stat()
+    except OSError:
+        # removed between readdir and stat, or a dangling symlink
+        return None
+    return ScanRecord(entry.path, st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def scan(
+    root: str | Path,
+    suffixes: frozenset[str],
+    excluded_dirs: frozenset[str] = frozenset(),
+) -> Iterator[ScanRecord]:
+    """Walk `root` once with `os.scandir`, yielding a record for every matching file."""
+    pending = [str(root)]
+    while pending:
+        directory = pending.pop()
+        try:
+            records, subdirs = scan_directory(directory, suffixes, excluded_dirs)
+        except OSError:
+            continue
+        yield from records
+        pending.extend(reversed(subdirs))
@@ -0,0 +1,157 @@
+import os
+import queue
+import re
+import threading
+from collections.abc import Iterable
+
+from .catalog import CatalogChange
+from .metadata import ImageMetadata, SidecarCache
+from .scanner import ScanRecord
+
+_TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> frozenset[str]:
+    return frozenset(_TOKEN.findall(text.lower()))
+
+
+def _prompt_tokens(metadata: ImageMetadata | None) -> frozenset[str]:
+    if metadata is None or not isinstance(metadata.prompt, str):
+        return frozenset()
+    return tokenize(metadata.prompt)
+
+
+class PromptIndex:
+    """Inverted index from prompt tokens to the catalog's images, for `/search`.
+
+    Subscribe `apply` to a `Catalog`: changes are queued and indexed by a background
+    thread, so a first listing of a large gallery does not wait on reading every
+    sidecar. Queries see whatever has been indexed so far.
+
+    Sidecars are read again when their directory is re-listed, and an edit noticed by
+    the `SidecarCache` (e.g. when the slide is viewed) is applied right away.
+    """
+
+    def __init__(self, sidecar_cache: SidecarCache):
+        self.sidecar_cache = sidecar_cache
+        self._ids: dict[str, int] = {}
+        self._records: dict[int, ScanRecord] = {}
+        self._tokens: dict[int, frozenset[str]] = {}
+        self._postings: dict[str, set[int]] = {}
+        self._ids_by_dir: dict[str, set[int]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._changes: queue.SimpleQueue[CatalogChange] = queue.SimpleQueue()
+        self._indexed = threading.Condition()
+        self._unindexed = 0
+        sidecar_cache.subscribe(self._sidecar_changed)
+        threading.Thread(target=self._run, name="prompt-index", daemon=True).start()
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def apply(self, change: CatalogChange):
+        with self._indexed:
+            self._unindexed += 1
+        self._changes.put(change)
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """Block until every queued change is indexed, returns False on timeout."""
+        with self._indexed:
+            return self._indexed.wait_for(lambda: not self._unindexed, timeout)
+
+    def search(self, query: str) -> list[ScanRecord]:
+        """Images whose prompt holds every token of `query`, unordered."""
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        with self._lock:
+            postings = sorted(
+                (self._postings.get(token, set()) for token in tokens), key=len
+            )
+            ids = set(postings[0])
+            for posting in postings[1:]:
+                if not ids:
+                    break
+                ids &= posting
+            return [self._records[_] for _ in ids]
+
+    def stats(self) -> dict:
+        return {
+            "images": len(self._records),
+            "tokens": len(self._postings),
+            "queued": self._unindexed,
+        }
+
+    def _run(self):
+        while True:
+            change = self._changes.get()
+            try:
+                self._index_change(change)
+            finally:
+                with self._indexed:
+                    self._unindexed -= 1
+                    self._indexed.notify_all()
+
+    def _index_change(self, change: CatalogChange):
+        for directory in change.removed_dirs:
+            with self._lock:
+                for image_id in self._ids_by_dir.pop(directory, set()):
+                    self._remove(image_id)
+        for directory, state in change.listed.items():
+            listed = {record.path for record in state.records}
+            with self._lock:
+                for image_id in list(self._ids_by_dir.get(directory, ())):
+                    if self._records[image_id].path not in listed:
+                        self._remove(image_id)
+            self._index_records(state.records)
+        with self._lock:
+            for path in change.discarded:
+                image_id = self._ids.get(path)
+                if image_id is not None:
+                    self._remove(image_id)
+
+    def _index_records(self, records: Iterable[ScanRecord]):
+        for record in records:
+            tokens = _prompt_tokens(self.sidecar_cache.get(record.path))
+            with self._lock:
+                self._add(record, tokens)
+
+    def _sidecar_changed(self, image_path: str, metadata: ImageMetadata | None):
+        with self._lock:
+            image_id = self._ids.get(image_path)
+            if image_id is not None:
+                self._add(self._records[image_id], _prompt_tokens(metadata))
+
+    def _add(self, record: ScanRecord, tokens: frozenset[str]):
+        image_id = self._ids.get(record.path)
+        if image_id is None:
+            image_id = self._ids[record.path] = self._next_id
+            self._next_id += 1
+            directory = os.path.dirname(record.path)
+            self._ids_by_dir.setdefault(directory, set()).add(image_id)
+        self._records[image_id] = record
+        previous = self._tokens.get(image_id, frozenset())
+        if previous == tokens:
+            return
+        for token in previous - tokens:
+            self._drop_posting(token, image_id)
+        for token in tokens - previous:
+            self._postings.setdefault(token, set()).add(image_id)
+        self._tokens[image_id] = tokens
+
+    def _remove(self, image_id: int):
+        record = self._records.pop(image_id)
+        del self._ids[record.path]
+        for token in self._tokens.pop(image_id, ()):
+            self._drop_posting(token, image_id)
+        ids = self._ids_by_dir.get(os.path.dirname(record.path))
+        if ids is not None:
+            ids.discard(image_id)
+
+    def _drop_posting(self, token: str, image_id: int):
+        posting = self._postings.get(token)
+        if posting is not None:
+            posting.discard(image_id)
+            if not posting:
+                del self._postings[token]
@@ -0,0 +1,95 @@
+import base64
+import hashlib
+import heapq
+import json
+from collections.abc import Callable, Iterable
+from typing import Literal
+
+from .scanner import ScanRecord
+
+SortOrder = Literal["newest", "oldest", "shuffled"]
+SORT_ORDERS = ("newest", "oldest", "shuffled")
+
+# full orderings, ties broken by path so results are stable between calls
+SORT_KEYS: dict[str, Callable[[ScanRecord], tuple]] = {
+    "newest": lambda record: (-record.mtime_ns, record.path),
+    "oldest": lambda record: (record.mtime_ns, record.path),
+}
+
+
+# the types of a key's parts per ordering, including the duplicate groups' order
+KEY_LAYOUTS: dict[str, tuple[type, ...]] = {
+    "newest": (int, str),
+    "oldest": (int, str),
+    "shuffled": (int, str),
+    "duplicates": (str, int, str),
+}
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+def sort_key(sort_order: SortOrder, seed: int = 0) -> Callable[[ScanRecord], tuple]:
+    if sort_order != "shuffled":
+        return SORT_KEYS[sort_order]
+    # each image's rank is a keyed hash of its path, so the order does not depend on
+    # listing order and survives deletes; the smallest k ranks are a uniform sample
+    # keyed once, each path hashes from a copy of that state
+    keyed = hashlib.blake2b(digest_size=8, key=str(seed).encode()[:64])
+
+    def shuffled(record: ScanRecord) -> tuple:
+        digest = keyed.copy()
+        digest.update(record.path.encode())
+        return (int.from_bytes(digest.digest(), "big"), record.path)
+
+    return shuffled
+
+
+def select_top_k(
+    records: Iterable[ScanRecord],
+    k: int,
+    sort_order: SortOrder = "newest",
+    seed: int = 0,
+    after: tuple | None = None,
+) -> tuple[list[ScanRecord], int]:
+    """Pick the first `k` records in `sort_order` and count all records, in one pass.
+
+    Records stream through a bounded heap, O(n log k) time and O(k) memory. With
+    `after`, only records sorting strictly after that key are candidates, which
+    is how cursors page through a stable ordering.
+    """
+    key = sort_key(sort_order, seed)
+    total = 0
+
+    def candidates():
+        nonlocal total
+        for record in records:
+            total += 1
+            record_key = key(record)
+            if after is None or record_key > after:
+                yield record_key, record
+
+    selected = heapq.nsmallest(k, candidates(), key=lambda item: item[0])
+    return [record for _, record in selected], total
+
+
+def encode_cursor(key: tuple, position: int) -> str:
+    """Opaque token for the page after the record with `key`, which was slide `position`."""
+    payload = json.dumps([list(key), position], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor: str, sort_order: str) -> tuple[tuple, int]:
+    """The key and position in `cursor`, checked against the layout of `sort_order`'s keys."""
+    layout = KEY_LAYOUTS[sort_order]
+    try:
+        key, position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        # exact types, so a JSON true does not pass for an int
+        if len(key) != len(layout) or any(
+            type(part) is not kind for part, kind in zip(key, layout)
+        ):
+            raise TypeError(f"cursor key does not match {sort_order} order")
+        return tuple(key), int(position)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursorError(f"malformed cursor {cursor!r}") from e
@@ -0,0 +1,325 @@
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import NamedTuple
+
+
+class ThumbnailKey(NamedTuple):
+    path: str
+    mtime_ns: int
+    size: int
+    width: int
+    format: str
+    # resample and encode presets, see `ImageWorkerPool.settings`
+    settings: str = ""
+
+    @classmethod
+    def for_file(
+        cls, path: str | Path, width: int, format: str, settings: str = ""
+    ) -> "ThumbnailKey":
+        st = Path(path).stat()
+        return cls(
+            str(path), st.st_mtime_ns, st.st_size, width, format.upper(), settings
+        )
+
+    @property
+    def version(self) -> str:
+        """Changes whenever the source image or the render settings do, for cache-busting URLs."""
+        return f"{self.mtime_ns:x}-{self.size:x}-{self.settings}"
+
+    @property
+    def etag(self) -> str:
+        """Strong validator: a rendition only changes with the source's mtime or size, or the settings."""
+        return f'"{self.version}-{self.width}-{self.format.lower()}"'
+
+
+class ThumbnailCache:
+    """Process-wide LRU cache of encoded thumbnail bytes, bounded by total size."""
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[ThumbnailKey, bytes] = OrderedDict()
+        self._keys_by_path: dict[str, set[ThumbnailKey]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: ThumbnailKey) -> bool:
+        return key in self._entries
+
+    def get(self, key: ThumbnailKey) -> bytes | None:
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key: ThumbnailKey, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = data
+            self._keys_by_path.setdefault(key.path, set()).add(key)
+            self.current_bytes += len(data)
+            while self.current_bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, path: str | Path) -> int:
+        """Drop every cached rendition of `path`, returns the number of entries removed."""
+        with self._lock:
+            keys = self._keys_by_path.get(str(path), set()).copy()
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_path.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _remove(self, key: ThumbnailKey):
+        data = self._entries.pop(key)
+        self.current_bytes -= len(data)
+        path_keys = self._keys_by_path.get(key.path)
+        if path_keys is not None:
+            path_keys.discard(key)
+            if not path_keys:
+                del self._keys_by_path[key.path]
+
+
+class _PackEntry(NamedTuple):
+    offset: int
+    length: int
+
+
+class ThumbnailStore:
+    """Persistent thumbnail store: an append-only pack of encoded blobs plus an index of offsets.
+
+    Blobs are read back through a read-only `mmap` of the pack file, so a hit is a
+    dict lookup and a memoryview slice with no decode and no copy.
+    """
+
+    PACK_NAME = "thumbnails.pack"
+    INDEX_NAME = "thumbnails.idx"
+    MAGIC = b"MFXGTHB2"
+    # mtime_ns, size, width, offset, length, path length, format length, settings length
+    RECORD = struct.Struct("<qqIQIHBB")
+
+    def __init__(self, cache_dir: Path):
+        self.cache_dir = cache_dir
+        self.pack_path = cache_dir / self.PACK_NAME
+        self.index_path = cache_dir / self.INDEX_NAME
+        self.hits = 0
+        self.misses = 0
+        self._entries: dict[ThumbnailKey, _PackEntry] = {}
+        self._keys_by_path: dict[str, set[ThumbnailKey]] = {}
+        self._lock = threading.Lock()
+        self._mmap = None
+        self._pack = None
+        self._index = None
+        self._open()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: ThumbnailKey) -> bool:
+        return key in self._entries
+
+    def get(self, key: ThumbnailKey) -> memoryview | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            end = entry.offset + entry.length
+            if self._mmap is None or len(self._mmap) < end:
+                self._remap()
+            self.hits += 1
+            return memoryview(self._mmap)[entry.offset : end]
+
+    def put(self, key: ThumbnailKey, data: bytes):
+        with self._lock:
+            offset = self._pack.seek(0, os.SEEK_END)
+            self._pack.write(data)
+            self._pack.flush()
+            # the index record is only written once its blob is in the pack, so a
+            # crash can leave unreferenced bytes but never a dangling record
+            self._index.write(self._index_record(key, offset, len(data)))
+            self._index.flush()
+            self._entries[key] = _PackEntry(offset, len(data))
+            self._keys_by_path.setdefault(key.path, set()).add(key)
+
+    def invalidate(self, path: str | Path) -> int:
+        """Forget every stored rendition of `path`; the bytes are reclaimed by `compact`."""
+        with self._lock:
+            stale = self._keys_by_path.pop(str(path), set())
+            for key in stale:
+                del self._entries[key]
+            return len(stale)
+
+    def compact(self) -> tuple[int, int]:
+        """Rewrite the pack keeping only entries whose source file is unchanged.
+
+        Returns the number of entries kept and dropped.
+        """
+        with self._lock:
+            self._remap()
+            live = {}
+            for key, entry in self._entries.items():
+                try:
+                    st = os.stat(key.path)
+                except OSError:
+                    continue
+                if st.st_mtime_ns == key.mtime_ns and st.st_size == key.size:
+                    live[key] = entry
+            dropped = len(self._entries) - len(live)
+
+            pack_tmp = self.pack_path.with_suffix(".pack.tmp")
+            index_tmp = self.index_path.with_suffix(".idx.tmp")
+            entries = {}
+            with open(pack_tmp, "wb") as pack, open(index_tmp, "wb") as index:
+                pack.write(self.MAGIC)
+                index.write(self.MAGIC)
+                for key, entry in live.items():
+                    offset = pack.tell()
+                    pack.write(self._mmap[entry.offset : entry.offset + entry.length])
+                    index.write(self._index_record(key, offset, entry.length))
+                    entries[key] = _PackEntry(offset, entry.length)
+
+            self._close_files()
+            # memoryviews handed out earlier keep the old mapping (and inode) alive
+            self._mmap = None
+            os.replace(pack_tmp, self.pack_path)
+            os.replace(index_tmp, self.index_path)
+            self._open_files()
+            self._set_entries(entries)
+            self._remap()
+            return len(live), dropped
+
+    def close(self):
+        with self._lock:
+            self._close_files()
+            self._mmap = None
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "live_bytes": sum(entry.length for entry in self._entries.values()),
+            "pack_bytes": self.pack_path.stat().st_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _open(self):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        for file_path in (self.pack_path, self.index_path):
+            with open(file_path, "ab+") as f:
+                f.seek(0)
+                magic = f.read(len(self.MAGIC))
+                if magic != self.MAGIC:
+                    # new or unrecognized file: start over
+                    f.truncate(0)
+                    f.write(self.MAGIC)
+        self._open_files()
+        self._set_entries(self._load_index())
+        self._remap()
+
+    def _set_entries(self, entries: dict[ThumbnailKey, _PackEntry]):
+        self._entries = entries
+        self._keys_by_path = {}
+        for key in entries:
+            self._keys_by_path.setdefault(key.path, set()).add(key)
+
+    def _open_files(self):
+        self._pack = open(self.pack_path, "ab+")
+        self._index = open(self.index_path, "ab")
+
+    def _close_files(self):
+        for f in (self._pack, self._index):
+            if f is not None:
+                f.close()
+        self._pack = self._index = None
+
+    def _remap(self):
+        self._mmap = mmap.mmap(self._pack.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _index_record(self, key: ThumbnailKey, offset: int, length: int) -> bytes:
+        path_bytes = key.path.encode("utf-8")
+        format_bytes = key.format.encode("ascii")
+        settings_bytes = key.settings.encode("ascii")
+        return (
+            self.RECORD.pack(
+                key.mtime_ns,
+                key.size,
+                key.width,
+                offset,
+                length,
+                len(path_bytes),
+                len(format_bytes),
+                len(settings_bytes),
+            )
+            + path_bytes
+            + format_bytes
+            + settings_bytes
+        )
+
+    def _load_index(self) -> dict[ThumbnailKey, _PackEntry]:
+        pack_size = self.pack_path.stat().st_size
+        data = self.index_path.read_bytes()
+        entries = {}
+        pos = len(self.MAGIC)
+        while pos + self.RECORD.size <= len(data):
+            (
+                mtime_ns,
+                size,
+                width,
+                offset,
+                length,
+                path_len,
+                format_len,
+                settings_len,
+            ) = self.RECORD.unpack_from(data, pos)
+            pos += self.RECORD.size
+            format_start = pos + path_len
+            settings_start = format_start + format_len
+            end = settings_start + settings_len
+            if end > len(data):
+                break  # truncated trailing record
+            path = data[pos:format_start].decode("utf-8")
+            format = data[format_start:settings_start].decode("ascii")
+            settings = data[settings_start:end].decode("ascii")
+            pos = end
+            if offset + length <= pack_size:
+                key = ThumbnailKey(path, mtime_ns, size, width, format, settings)
+                entries[key] = _PackEntry(offset, length)
+        return entries
@@ -0,0 +1,241 @@
+import os
+import threading
+import time
+from collections import deque
+from collections.abc import Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Literal
+from urllib.parse import quote
+
+DeleteMode = Literal["trash", "permanent"]
+
+
+class Deletion:
+    """One delete request: an image, its companion files, and where they went in the trash."""
+
+    __slots__ = ("path", "companions", "requested_at", "trashed", "done")
+
+    def __init__(self, path: str, companions: tuple[str, ...]):
+        self.path = path
+        self.companions = companions
+        self.requested_at = time.monotonic()
+        # (original path, name under the trash's files/) per moved file
+        self.trashed: list[tuple[str, str]] = []
+        self.done = False
+
+    @property
+    def paths(self) -> tuple[str, ...]:
+        return (self.path, *self.companions)
+
+
+def trash_dir(top_dir: Path) -> Path:
+    """The freedesktop.org trash directory of `top_dir`, `$topdir/.Trash-$uid`."""
+    return top_dir / f".Trash-{os.getuid()}"
+
+
+def _trash_info(original: str, deleted_at: datetime) -> bytes:
+    return (
+        "[Trash Info]\n"
+        f"Path={quote(original)}\n"
+        f"DeletionDate={deleted_at.strftime('%Y-%m-%dT%H:%M:%S')}\n"
+    ).encode()
+
+
+def _remove(path: str) -> bool:
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+class DeleteQueue:
+    """Deletes images on a background thread, so the request only has to enqueue them.
+
+    Requests arriving while a batch is being processed are handled together in the
+    next batch. In `trash` mode files are renamed into a trash directory following the
+    freedesktop.org layout (`files/` plus an `info/<name>.trashinfo` per file), and the
+    last `undo_limit` deletes made within `undo_window` seconds can be restored.
+    `on_done` is called from the worker with each finished `Deletion`.
+    """
+
+    def __init__(
+        self,
+        trash_path: Path,
+        mode: DeleteMode = "trash",
+        undo_limit: int = 10,
+        undo_window: float = 300.0,
+        on_done: Callable[[Deletion], None] | None = None,
+        workers: int = 4,
+    ):
+        self.trash_path = trash_path
+        self.mode = mode
+        self.undo_limit = undo_limit
+        self.undo_window = undo_window
+        self.on_done = on_done
+        self.batches = 0
+        self.deleted = 0
+        self._pending: deque[Deletion] = deque()
+        self._undoable: deque[Deletion] = deque(maxlen=undo_limit)
+        self._cond = threading.Condition()
+        self._busy = False
+        # carries out the deletes of a large batch in parallel
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="delete-queue"
+        )
+        self._worker = threading.Thread(
+            target=self._run, name="delete-queue", daemon=True
+        )
+        self._worker.start()
+
+    @property
+    def files_dir(self) -> Path:
+        return self.trash_path / "files"
+
+    @property
+    def info_dir(self) -> Path:
+        return self.trash_path / "info"
+
+    def submit(
+        self, path: str | Path, companions: Iterable[str | Path] = ()
+    ) -> Deletion:
+        [deletion] = self.submit_many([(path, companions)])
+        return deletion
+
+    def submit_many(
+        self, items: Iterable[tuple[str | Path, Iterable[str | Path]]]
+    ) -> list[Deletion]:
+        """Queue several images, with their companions, to be deleted in the same batch."""
+        deletions = [
+            Deletion(str(path), tuple(str(_) for _ in companions))
+            for path, companions in items
+        ]
+        with self._cond:
+            self._pending.extend(deletions)
+            if self.mode == "trash":
+                self._undoable.extend(deletions)
+            self._cond.notify_all()
+        return deletions
+
+    def undo(self) -> Deletion | None:
+        """Restore the most recent delete still within the undo window, if any."""
+        with self._cond:
+            # wait out a batch in flight, so the deletion is either pending or done
+            self._cond.wait_for(lambda: not self._busy)
+            while self._undoable:
+                deletion = self._undoable.pop()
+                if time.monotonic() - deletion.requested_at > self.undo_window:
+                    self._undoable.clear()
+                    return None
+                if not deletion.done:
+                    self._pending.remove(deletion)
+                    return deletion
+                if self._restore(deletion):
+                    return deletion
+            return None
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Wait until every submitted delete has been carried out."""
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: not self._pending and not self._busy, timeout
+            )
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "pending": len(self._pending),
+            "batches": self.batches,
+            "deleted": self.deleted,
+            "undoable": len(self._undoable),
+        }
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending)
+                batch = list(self._pending)
+                self._pending.clear()
+                self._busy = True
+            try:
+                self._process(batch)
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+
+    def _process(self, batch: list[Deletion]):
+        if self.mode == "trash":
+            self.files_dir.mkdir(parents=True, exist_ok=True)
+            self.info_dir.mkdir(parents=True, exist_ok=True)
+        deleted_at = datetime.now()
+        if len(batch) > 1:
+            counts = self._executor.map(lambda _: self._delete(_, deleted_at), batch)
+        else:
+            counts = [self._delete(_, deleted_at) for _ in batch]
+        self.deleted += sum(counts)
+        self.batches += 1
+
+    def _delete(self, deletion: Deletion, deleted_at: datetime) -> int:
+        deleted = 0
+        try:
+            for path in deletion.paths:
+                if self.mode == "trash":
+                    deleted += self._move_to_trash(deletion, path, deleted_at)
+                else:
+                    deleted += _remove(path)
+        except OSError as e:
+            print(f"Failed to delete {deletion.path!r}: {e}")
+        deletion.done = True
+        if self.on_done is not None:
+            self.on_done(deletion)
+        return deleted
+
+    def _move_to_trash(
+        self, deletion: Deletion, path: str, deleted_at: datetime
+    ) -> bool:
+        name = self._reserve_name(os.path.basename(path), _trash_info(path, deleted_at))
+        try:
+            os.rename(path, self.files_dir / name)
+        except FileNotFoundError:
+            os.unlink(self.info_dir / f"{name}.trashinfo")
+            return False
+        deletion.trashed.append((path, name))
+        return True
+
+    def _reserve_name(self, name: str, info: bytes) -> str:
+        """Claim a name in the trash by creating its .trashinfo exclusively, as the spec asks."""
+        stem, suffix = os.path.splitext(name)
+        candidate, n = name, 1
+        while True:
+            fd = self._create_exclusive(self.info_dir / f"{candidate}.trashinfo")
+            if fd is not None and not (self.files_dir / candidate).exists():
+                break
+            if fd is not None:
+                os.close(fd)
+                os.unlink(self.info_dir / f"{candidate}.trashinfo")
+            n += 1
+            candidate = f"{stem}.{n}{suffix}"
+        with os.fdopen(fd, "wb") as f:
+            f.write(info)
+        return candidate
+
+    @staticmethod
+    def _create_exclusive(path: Path) -> int | None:
+        try:
+            return os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            return None
+
+    def _restore(self, deletion: Deletion) -> bool:
+        restored = False
+        for original, name in deletion.trashed:
+            if os.path.exists(original):
+                # something new took its place, leave this one in the trash
+                continue
+            os.rename(self.files_dir / name, original)
+            _remove(str(self.info_dir / f"{name}.trashinfo"))
+            restored = True
+        return restored